@@ -6,20 +6,27 @@
 
 __version__ = "0.1.0"
 
+import io
 import logging
 import shutil
+import tarfile
 import tempfile
+import uuid
 
 from dodoo.utils import odoo as odooutils
 from dodoo.utils import db as dbutils
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from datetime import datetime
 
-from .file_type_identifier import file_type
+from . import repository
+from .compression import compressed, decompressed, suffix
+from .file_type_identifier import file_type, stream_type
 
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Optional
 
 _log = logging.getLogger(__name__)
 
@@ -36,6 +43,7 @@ class FolderStructureUnkown(Exception):
 def _extracted(path: Path) -> Path:
     if path.is_dir():
         yield path
+        return
     ftype = file_type(str(path))
     if not ftype:
         raise FileNoteRecorgnized()
@@ -47,7 +55,8 @@ def _extracted(path: Path) -> Path:
 
 def _validate_convention(dir: Path) -> bool:
     db_bkp = dir / "db.dump"
-    if not db_bkp.is_file():
+    # A custom format dump file or a directory format dump
+    if not (db_bkp.is_file() or (db_bkp / "toc.dat").is_file()):
         raise FolderStructureUnkown()
     fs_bkp = dir / "filestore"
     if fs_bkp.exists() and not fs_bkp.is_dir():
@@ -55,29 +64,146 @@ def _validate_convention(dir: Path) -> bool:
     return True
 
 
-def backup(filestore_include: bool, dbname: str, dest: Path) -> Path:
+def _write_archive(
+    fileobj: BinaryIO,
+    dbname: str,
+    filestore_include: bool,
+    codec: str = "gzip",
+    level: Optional[int] = None,
+    dump_format: str = "custom",
+    jobs: Optional[int] = None,
+) -> None:
+    """Stream a compressed tar archive following the backup convention to fileobj.
+
+    The filestore is archived straight from its location while pg_dump runs
+    concurrently. As tar headers carry the member size, the (comparatively
+    small) dump is spooled and appended last."""
+    # The executor is shut down (waits for pg_dump) before tmp is removed,
+    # even if archiving the filestore fails
+    with tempfile.TemporaryDirectory(prefix="dump") as tmp, ThreadPoolExecutor(
+        max_workers=1
+    ) as executor, compressed(fileobj, codec, level) as out, tarfile.open(
+        fileobj=out, mode="w|"
+    ) as tar:
+        dump = Path(tmp) / "db.dump"
+        directory = dump_format == "directory"
+        dumped = executor.submit(
+            dbutils.backup_database, dbname, dump, directory=directory, jobs=jobs
+        )
+        # Convention!
+        if filestore_include:
+            odooutils.archive_filestore(dbname, tar, "filestore")
+        dumped.result()
+        tar.add(str(dump), "db.dump")
+
+
+def backup(
+    filestore_include: bool,
+    dbname: str,
+    dest: Optional[Path],
+    stream: BinaryIO = None,
+    codec: str = "gzip",
+    level: Optional[int] = None,
+    dump_format: str = "custom",
+    jobs: Optional[int] = None,
+    incremental: bool = False,
+) -> Optional[Path]:
     """Creates a compressed archive of an odoo instance backup, optionally
-    with filestore included."""
+    with filestore included. The pgzip and zstd codecs compress on all cores,
+    the directory dump format dumps tables in parallel jobs. Incremental
+    backups snapshot into a repository, storing only new filestore blobs."""
     if not dbutils.db_exists(dbname):
         msg = f"Database {dbname} doesn't exists."
         _log.error(msg)
         return
-    with tempfile.TemporaryDirectory(prefix="prepare") as dir:
-        dir = Path(str(dir))
-        # Convention!
-        db_bkp = dir / "db.dump"
-        fs_bkp = dir / "filestore"
-        dbutils.backup_database(dbname, db_bkp)
-        odooutils.backup_filestore(dbname, fs_bkp)
-        timestamp = datetime.isoformat(datetime.now(), timespec="seconds")
-        archive = dest / f"{timestamp}.{dbname}"
-        archive = shutil.make_archive(archive, "gztar", dir)
-        return Path(archive)
+    if incremental:
+        return repository.backup(filestore_include, dbname, dest, dump_format, jobs)
+    if stream:
+        _write_archive(
+            stream, dbname, filestore_include, codec, level, dump_format, jobs
+        )
+        return
+    timestamp = datetime.isoformat(datetime.now(), timespec="seconds")
+    archive = dest / f"{timestamp}.{dbname}{suffix(codec)}"
+    partial = archive.with_name(archive.name + ".part")
+    try:
+        with partial.open("wb") as f:
+            _write_archive(
+                f, dbname, filestore_include, codec, level, dump_format, jobs
+            )
+    except BaseException:
+        partial.unlink()
+        raise
+    partial.rename(archive)
+    return archive
+
+
+def _staging_name(dbname: str) -> str:
+    return f"{dbname}-restore-{uuid.uuid4().hex[:8]}"[:63]
 
 
-def restore(clear: bool, dbname: str, src: Path) -> None:
+def _drop_staging(dbname: str) -> None:
+    if dbutils.db_exists(dbname):
+        dbutils.drop_database(dbname)
+    odooutils.drop_filestore(dbname)
+
+
+def _restore_dir(dbname: str, src: Path, jobs: Optional[int]) -> None:
+    _validate_convention(src)
+    # Convention!
+    db_bkp = src / "db.dump"
+    fs_bkp = src / "filestore"
+    dbutils.restore_database(dbname, db_bkp, jobs=jobs)
+    if fs_bkp.exists():
+        odooutils.restore_filestore(dbname, fs_bkp, max_workers=jobs)
+
+
+def _restore_stream(dbname: str, stream: BinaryIO, jobs: Optional[int]) -> None:
+    """Restore in a single read pass over the archive: a custom format dump is
+    piped into pg_restore and filestore members are extracted in place. Only
+    directory format dumps are staged, as pg_restore needs them on disk."""
+    if not hasattr(stream, "peek"):
+        stream = io.BufferedReader(stream)
+    dump = None
+    with decompressed(stream, stream_type(stream)) as reader, tarfile.open(
+        fileobj=reader, mode="r|*"
+    ) as tar, tempfile.TemporaryDirectory(prefix="dump") as tmp:
+        for member in tar:
+            path = PurePosixPath(member.name)
+            if not path.parts or ".." in path.parts:
+                continue
+            member.name = str(path)
+            # Convention!
+            if path.parts[0] == "db.dump":
+                if member.isfile() and len(path.parts) == 1:
+                    dbutils.restore_database_stream(dbname, tar.extractfile(member))
+                    dump = "custom"
+                else:
+                    tar.extract(member, tmp)
+                    dump = dump or "directory"
+            elif path.parts[0] == "filestore":
+                if len(path.parts) == 1 and not member.isdir():
+                    raise FolderStructureUnkown()
+                odooutils.extract_filestore_member(dbname, tar, member, "filestore")
+        if dump == "directory":
+            _validate_convention(Path(tmp))
+            dbutils.restore_database(dbname, Path(tmp) / "db.dump", jobs=jobs)
+        elif not dump:
+            raise FolderStructureUnkown()
+
+
+def restore(
+    clear: bool,
+    dbname: str,
+    src: Optional[Path],
+    jobs: Optional[int] = None,
+    stream: BinaryIO = None,
+) -> None:
     """Restores an odoo instance backup, from one of the supported archives
-    types: zip, tar, gztar, xztar, bztar."""
+    types: zip, tar, gztar, xztar, bztar, zstdtar, or from a repository
+    snapshot (incremental backup). Tar archives are restored
+    as a stream, without extracting them first. Directory format dumps are
+    restored in parallel jobs, one per core by default."""
 
     exists = dbutils.db_exists(dbname)
     if exists and not clear:
@@ -85,30 +211,46 @@ def restore(clear: bool, dbname: str, src: Path) -> None:
         _log.error(msg)
         return
 
-    with _extracted(src) as src:
-        _validate_convention(src)
-        # Keep this here after validation
-        if exists:
-            msg = f"Dropping database & filestore of {dbname} before restoring."
-            _log.warning(msg)
-            try:
-                count = dbutils.terminate_connections(dbname)
-                if count:
-                    msg = f"Disconnected {count} active connections from '{dbname}'."
-                    _log.warning(msg)
-                dbutils.drop_database(dbname)
-                odooutils.drop_filestore(dbname)
-            except Exception:
-                msg = f"Database & filestore fof {dbname} could not be pruned."
-                _log.error(msg, exc_info=True)
-                return
-            else:
-                msg = f"Database & filestore {dbname} pruned."
-                _log.info(msg)
-        # Convention!
-        db_bkp = src / "db.dump"
-        fs_bkp = src / "filestore"
-        dbutils.restore_database(dbname, db_bkp)
-        odooutils.restore_filestore(dbname, fs_bkp)
-        msg = f"Database & filestore {dbname} restored."
-        _log.info(msg)
+    # Restore aside, so that broken archives never harm an existing database
+    staging = _staging_name(dbname)
+    try:
+        if stream:
+            _restore_stream(staging, stream, jobs)
+        elif repository.is_snapshot(src):
+            repository.restore(staging, src, jobs)
+        elif src.is_dir() or file_type(str(src)) == "zip":
+            with _extracted(src) as dir:
+                _restore_dir(staging, dir, jobs)
+        else:
+            with src.open("rb") as f:
+                _restore_stream(staging, f, jobs)
+    except tarfile.ReadError:
+        _drop_staging(staging)
+        raise FileNoteRecorgnized()
+    except BaseException:
+        _drop_staging(staging)
+        raise
+
+    # Keep this here after the (validated) restore
+    if exists:
+        msg = f"Dropping database & filestore of {dbname} before restoring."
+        _log.warning(msg)
+        try:
+            count = dbutils.terminate_connections(dbname)
+            if count:
+                msg = f"Disconnected {count} active connections from '{dbname}'."
+                _log.warning(msg)
+            dbutils.drop_database(dbname)
+            odooutils.drop_filestore(dbname)
+        except Exception:
+            msg = f"Database & filestore fof {dbname} could not be pruned."
+            _log.error(msg, exc_info=True)
+            _drop_staging(staging)
+            return
+        else:
+            msg = f"Database & filestore {dbname} pruned."
+            _log.info(msg)
+    dbutils.rename_database(staging, dbname)
+    odooutils.rename_filestore(staging, dbname)
+    msg = f"Database & filestore {dbname} restored."
+    _log.info(msg)
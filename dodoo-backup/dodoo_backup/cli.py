@@ -5,14 +5,13 @@
 # =============================================================================
 """This module implements the cli subcommand for dodoo backup & restore"""
 
-import shutil
-import sys
-import tempfile
-from pathlib import Path
+from datetime import timedelta
 
 import click
 import click_pathlib
 from dodoo_backup import __version__, backup as _backup, restore as _restore
+from dodoo_backup.compression import CODECS, valid_levels
+from dodoo_backup.gc import gc_filestore as _gc_filestore
 
 from dodoo.cli import CONTEXT_SETTINGS, EPILOG
 
@@ -24,6 +23,39 @@ from dodoo.cli import CONTEXT_SETTINGS, EPILOG
     is_flag=True,
     help="Include data files into the backup (zip backup).",
 )
+@click.option(
+    "--codec",
+    type=click.Choice(sorted(CODECS)),
+    default="gzip",
+    show_default=True,
+    help="Compression codec; pgzip (gzip compatible) and zstd use all cores.",
+)
+@click.option(
+    "--level",
+    type=int,
+    help="Compression level, defaults to the codec's default (gzip: 9, zstd: 3).",
+)
+@click.option(
+    "--format",
+    "dump_format",
+    type=click.Choice(["custom", "directory"]),
+    default="custom",
+    show_default=True,
+    help="pg_dump format; directory dumps tables in parallel jobs.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Parallel pg_dump jobs (directory format, default: one per core) and "
+    "filestore blob copies (incremental).",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Snapshot into DEST as a backup repository, storing new filestore "
+    "blobs only.",
+)
 @click.argument("dbname")
 @click.argument(
     "dest",
@@ -32,11 +64,15 @@ from dodoo.cli import CONTEXT_SETTINGS, EPILOG
 )
 @click.version_option(version=__version__)
 def backup(*args, **kwargs):
+    if kwargs["incremental"] and not kwargs["dest"]:
+        raise click.UsageError("Incremental backups require a DEST repository.")
+    level = kwargs["level"]
+    if level is not None and level not in valid_levels(kwargs["codec"]):
+        raise click.BadParameter(
+            f"{level} is not a valid level for {kwargs['codec']}.", param_hint="level"
+        )
     if not kwargs["dest"]:
-        with tempfile.TemporaryDirectory() as dir:
-            kwargs["dest"] = Path(dir)
-            archive = _backup(*args, **kwargs)
-            shutil.copyfileobj(archive, sys.stdout)
+        _backup(*args, stream=click.get_binary_stream("stdout"), **kwargs)
     else:
         _backup(*args, **kwargs)
 
@@ -45,6 +81,12 @@ def backup(*args, **kwargs):
 @click.option(
     "--clear", "-c", is_flag=True, help="Clear database and filestore, if exist."
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Parallel pg_restore jobs (default: one per core) and filestore copies.",
+)
 @click.argument("dbname")
 @click.argument(
     "src", required=False, type=click_pathlib.Path(exists=True, resolve_path=True)
@@ -52,13 +94,29 @@ def backup(*args, **kwargs):
 @click.version_option(version=__version__)
 def restore(*args, **kwargs):
     if not kwargs["src"]:
-        with tempfile.NamedTemporaryFile() as file:
-            shutil.copyfileobj(sys.stdin, file)
-            kwargs["src"] = Path(file)
-            _restore(*args, **kwargs)
+        _restore(*args, stream=click.get_binary_stream("stdin"), **kwargs)
     else:
         _restore(*args, **kwargs)
 
 
+@click.command(
+    context_settings=CONTEXT_SETTINGS, help=_gc_filestore.__doc__, epilog=EPILOG
+)
+@click.option(
+    "--remove", is_flag=True, help="Remove orphaned blobs instead of reporting them."
+)
+@click.option(
+    "--min-age",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Spare blobs younger than so many days.",
+)
+@click.argument("dbname")
+@click.version_option(version=__version__)
+def filestore_gc(dbname, remove, min_age):
+    _gc_filestore(dbname, remove, timedelta(days=min_age))
+
+
 if __name__ == "__main__":  # pragma: no cover
     backup()
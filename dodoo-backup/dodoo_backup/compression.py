@@ -0,0 +1,163 @@
+# =============================================================================
+# Created By : David Arnold
+# Credits    : Mark Adler (pigz)
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the archive compression codecs"""
+
+import collections
+import gzip
+import os
+import shutil
+import struct
+import tarfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO
+
+# `zstandard` will be lazily imported as it's no hard dependency of dodoo backup
+
+BLOCK_SIZE = 128 * 1024
+DICT_SIZE = 32 * 1024
+
+
+class CodecNotAvailable(Exception):
+    pass
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise CodecNotAvailable("Install 'zstandard' to use the zstd codec.")
+    return zstandard
+
+
+def _deflate(block: bytes, zdict: bytes, level: int, final: bool) -> bytes:
+    # Raw deflate, primed with the tail of the previous block (like pigz)
+    args = (level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressor = (
+        zlib.compressobj(*args, zdict=zdict) if zdict else zlib.compressobj(*args)
+    )
+    # A sync flush ends byte-aligned without a final block, so that the
+    # independently compressed blocks concatenate into one deflate stream
+    mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(mode)
+
+
+class ParallelGzipWriter:
+    """A write-only file object emitting a standard gzip stream. Blocks are
+    deflated on all cores and written in order."""
+
+    def __init__(self, fileobj: BinaryIO, level: int = 6, workers: int = None):
+        self.fileobj = fileobj
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._previous = b""
+        self._crc = 0
+        self._size = 0
+        # magic, deflate, no flags, mtime, no extra flags, unknown os
+        header = b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time())) + b"\x00\xff"
+        self.fileobj.write(header)
+
+    def _submit(self, block: bytes, final: bool = False) -> None:
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        zdict = self._previous[-DICT_SIZE:]
+        future = self._executor.submit(_deflate, block, zdict, self.level, final)
+        self._pending.append(future)
+        self._previous = block
+        # Bound memory: don't run ahead of the writer too far
+        while len(self._pending) > 2 * self.workers:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_SIZE:
+            block = bytes(self._buffer[:BLOCK_SIZE])
+            del self._buffer[:BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._submit(bytes(self._buffer), final=True)
+        self._buffer.clear()
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().result())
+        self._executor.shutdown()
+        self.fileobj.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+
+
+# Default level, valid levels and archive suffix per codec
+CODECS = {
+    "gzip": (9, range(0, 10), ".tar.gz"),
+    "pgzip": (6, range(0, 10), ".tar.gz"),
+    "zstd": (3, range(1, 23), ".tar.zst"),
+}
+
+
+def default_level(codec: str) -> int:
+    return CODECS[codec][0]
+
+
+def valid_levels(codec: str) -> range:
+    return CODECS[codec][1]
+
+
+def suffix(codec: str) -> str:
+    return CODECS[codec][2]
+
+
+@contextmanager
+def compressed(fileobj: BinaryIO, codec: str, level: int = None) -> BinaryIO:
+    """Provide a file object compressing into fileobj."""
+    if level is None:
+        level = default_level(codec)
+    if level not in valid_levels(codec):
+        raise ValueError(f"Level {level} is not valid for codec {codec}.")
+    if codec == "gzip":
+        writer = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level)
+    elif codec == "pgzip":
+        writer = ParallelGzipWriter(fileobj, level)
+    elif codec == "zstd":
+        compressor = _zstandard().ZstdCompressor(level=level, threads=-1)
+        writer = compressor.stream_writer(fileobj, closefd=False)
+    else:
+        raise ValueError(f"Unknown codec {codec}.")
+    try:
+        yield writer
+    finally:
+        writer.close()
+
+
+@contextmanager
+def decompressed(fileobj: BinaryIO, ftype: str) -> BinaryIO:
+    """Provide a file object of the tar stream inside fileobj. Except for zstd,
+    decompression is left to tarfile's transparent stream mode ("r|*")."""
+    if ftype != "zstdtar":
+        yield fileobj
+        return
+    reader = _zstandard().ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    try:
+        yield reader
+    finally:
+        reader.close()
+
+
+def _unpack_zstdtar(filename: str, extract_dir: str) -> None:
+    decompressor = _zstandard().ZstdDecompressor()
+    with open(filename, "rb") as f, decompressor.stream_reader(f) as reader:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            tar.extractall(extract_dir)
+
+
+if "zstdtar" not in [name for name, _ext, _desc in shutil.get_unpack_formats()]:
+    shutil.register_unpack_format("zstdtar", [".tar.zst"], _unpack_zstdtar)
@@ -13,14 +13,24 @@ magic_dict = {
     b"\x42\x5a\x68": "bztar",
     b"\x75\x73\x74\x61\x72": "tar",
     b"\xfd\x37\x7a\x58\x5a\x00": "xztar",
+    b"\x28\xb5\x2f\xfd": "zstdtar",
 }
 
 max_len = max(len(x) for x in magic_dict)
 
 
-def file_type(filename):
-    with open(filename, "rb") as f:
-        file_start = f.read(max_len)
+def _identify(file_start):
     for magic, filetype in magic_dict.items():
         if file_start.startswith(magic):
             return filetype
+
+
+def file_type(filename):
+    with open(filename, "rb") as f:
+        file_start = f.read(max_len)
+    return _identify(file_start)
+
+
+def stream_type(stream):
+    """Identify a buffered stream without consuming it."""
+    return _identify(stream.peek(max_len)[:max_len])
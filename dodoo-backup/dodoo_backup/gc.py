@@ -0,0 +1,162 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the filestore garbage collection"""
+
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from dodoo.connections import OdooCursor
+from dodoo.interfaces import odoo
+from dodoo.utils import db as dbutils
+from dodoo.utils import ensure_framework
+
+_log = logging.getLogger(__name__)
+
+ITERSIZE = 100_000
+DEFAULT_MIN_AGE = timedelta(days=1)
+
+
+def _key(fname: str) -> Optional[int]:
+    """The leading 64 bits of a content-addressed fname: `ab/abcdef...`"""
+    if len(fname) != 43 or fname[2] != "/" or fname[:2] != fname[3:5]:
+        return None
+    try:
+        int(fname[3:], 16)
+    except ValueError:
+        return None
+    return int(fname[3:19], 16)
+
+
+class FnameIndex:
+    """A compact membership index of referenced filestore fnames.
+
+    Content-addressed fnames are kept as a sorted array of the 64 bit prefix
+    of their sha1 (8 bytes each, instead of a ~100 bytes python string), and
+    are looked up by bisection. Like a bloom filter, a prefix collision can
+    only ever keep an orphan, never remove a referenced blob."""
+
+    def __init__(self):
+        self._keys = array("Q")
+        self._others = set()
+        self._sorted = True
+
+    def add(self, fname: str) -> None:
+        key = _key(fname)
+        if key is None:
+            self._others.add(fname)
+            return
+        if self._keys and key < self._keys[-1]:
+            self._sorted = False
+        self._keys.append(key)
+
+    def __len__(self):
+        return len(self._keys) + len(self._others)
+
+    def __contains__(self, fname: str) -> bool:
+        key = _key(fname)
+        if key is None:
+            return fname in self._others
+        if not self._sorted:
+            self._keys = array("Q", sorted(self._keys))
+            self._sorted = True
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+
+def referenced_fnames(dbname: str) -> FnameIndex:
+    """Stream the referenced fnames through a single server side cursor."""
+    index = FnameIndex()
+    with OdooCursor(dbutils.database_dsn(dbname), dry=True) as cr:
+        named = cr.connection.cursor(name="dodoo_filestore_gc")
+        named.itersize = ITERSIZE
+        # Sorted, the index is built by appending
+        named.execute(
+            'SELECT DISTINCT store_fname COLLATE "C" FROM ir_attachment '
+            "WHERE store_fname IS NOT NULL ORDER BY 1"
+        )
+        for (fname,) in named:
+            index.add(fname)
+        named.close()
+    return index
+
+
+def _orphans(fs: Path, index: FnameIndex, before: float) -> Iterator[Tuple[Path, int]]:
+    # Only consider the two-level layout, leave odoo's checklist etc. alone
+    with os.scandir(str(fs)) as buckets:
+        for bucket in buckets:
+            if not bucket.is_dir() or len(bucket.name) != 2:
+                continue
+            with os.scandir(bucket.path) as blobs:
+                for blob in blobs:
+                    fname = f"{bucket.name}/{blob.name}"
+                    if not blob.is_file() or _key(fname) is None:
+                        continue
+                    st = blob.stat()
+                    if st.st_mtime < before and fname not in index:
+                        yield Path(blob.path), st.st_size
+
+
+def _fname(path: Path) -> str:
+    return f"{path.parent.name}/{path.name}"
+
+
+def _remove(dbname: str, orphans: List[Tuple[Path, int]]) -> Tuple[int, int]:
+    """Remove the orphans still not referenced while attachments are locked.
+
+    Odoo reuses an existing blob without rewriting it: an attachment created
+    since the index was built might reference an orphan by now. The share
+    lock waits for attachment writes in flight and blocks new ones until
+    the orphans are gone."""
+    count, size = 0, 0
+    with OdooCursor(dbutils.database_dsn(dbname), dry=True) as cr:
+        cr.execute("LOCK TABLE ir_attachment IN SHARE MODE")
+        for i in range(0, len(orphans), ITERSIZE):
+            batch = orphans[i : i + ITERSIZE]
+            cr.execute(
+                "SELECT store_fname FROM ir_attachment WHERE store_fname = ANY(%s)",
+                ([_fname(path) for path, _size in batch],),
+            )
+            referenced = {fname for (fname,) in cr.fetchall()}
+            for path, blob_size in batch:
+                if _fname(path) in referenced:
+                    continue
+                path.unlink()
+                count += 1
+                size += blob_size
+    return count, size
+
+
+@ensure_framework
+def gc_filestore(
+    dbname: str, remove: bool = False, min_age: timedelta = DEFAULT_MIN_AGE
+) -> Tuple[int, int]:
+    """Reports, or removes, filestore blobs which no attachment references.
+
+    Blobs younger than min_age are spared, as their attachment's transaction
+    might not yet be committed. Returns the orphans' count and bytes."""
+    fs = odoo.Config().filestore(dbname)
+    if not fs.exists():
+        return 0, 0
+    before = time.time() - min_age.total_seconds()
+    index = referenced_fnames(dbname)
+    msg = f"Indexed {len(index)} referenced blobs of {dbname}."
+    _log.info(msg)
+    orphans = list(_orphans(fs, index, before))
+    if remove:
+        count, size = _remove(dbname, orphans)
+    else:
+        for path, _size in orphans:
+            _log.debug(f"Orphaned blob: {path}")
+        count, size = len(orphans), sum(size for _path, size in orphans)
+    action = "Removed" if remove else "Found"
+    msg = f"{action} {count} orphaned blobs ({size / 2**20:.1f} MiB) in {fs}."
+    _log.info(msg)
+    return count, size
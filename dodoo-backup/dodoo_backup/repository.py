@@ -0,0 +1,80 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements incremental backups into a backup repository
+
+A repository holds the filestore blobs of all its snapshots exactly once:
+
+    <repository>/blobs/ab/abcdef...
+    <repository>/snapshots/<timestamp>.<dbname>/db.dump
+    <repository>/snapshots/<timestamp>.<dbname>/manifest.json
+
+Odoo's filestore is content-addressed by sha1, so each run only stores the
+blobs created since the last one, plus a manifest of the current blob set.
+"""
+
+import json
+import logging
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from dodoo.utils import odoo as odooutils
+from dodoo.utils import db as dbutils
+
+_log = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def is_snapshot(path: Path) -> bool:
+    return (path / MANIFEST).is_file()
+
+
+def backup(
+    filestore_include: bool,
+    dbname: str,
+    repository: Path,
+    dump_format: str = "custom",
+    jobs: Optional[int] = None,
+) -> Path:
+    timestamp = datetime.isoformat(datetime.now(), timespec="seconds")
+    snapshot = repository / "snapshots" / f"{timestamp}.{dbname}"
+    if snapshot.exists():
+        raise FileExistsError(snapshot)
+    partial = snapshot.with_name(snapshot.name + ".part")
+    partial.mkdir(parents=True)
+    try:
+        directory = dump_format == "directory"
+        dbutils.backup_database(
+            dbname, partial / "db.dump", directory=directory, jobs=jobs
+        )
+        fnames = []
+        if filestore_include:
+            fnames = odooutils.backup_filestore_blobs(
+                dbname, repository / "blobs", max_workers=jobs
+            )
+        manifest = {"version": MANIFEST_VERSION, "dbname": dbname, "blobs": fnames}
+        (partial / MANIFEST).write_text(json.dumps(manifest))
+    except BaseException:
+        shutil.rmtree(partial)
+        raise
+    partial.rename(snapshot)
+    msg = f"Snapshot {snapshot.name} of {len(fnames)} blobs stored in {repository}."
+    _log.info(msg)
+    return snapshot
+
+
+def restore(dbname: str, snapshot: Path, jobs: Optional[int] = None) -> None:
+    manifest = json.loads((snapshot / MANIFEST).read_text())
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {snapshot}.")
+    dbutils.restore_database(dbname, snapshot / "db.dump", jobs=jobs)
+    blobs = snapshot.parent.parent / "blobs"
+    if manifest["blobs"]:
+        odooutils.restore_filestore_blobs(
+            dbname, blobs, manifest["blobs"], max_workers=jobs
+        )
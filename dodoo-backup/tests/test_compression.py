@@ -0,0 +1,50 @@
+import gzip
+import io
+import os
+import shutil
+import tarfile
+
+import pytest
+from dodoo_backup import compression
+from dodoo_backup.file_type_identifier import file_type
+
+
+@pytest.fixture
+def payload():
+    # Compressible, but spanning several blocks
+    return b"".join(os.urandom(64) * 1000 for _ in range(10))
+
+
+@pytest.mark.parametrize("codec", ["gzip", "pgzip"])
+def test_gzip_codecs(codec, payload):
+    f = io.BytesIO()
+    with compression.compressed(f, codec) as out:
+        out.write(payload[:100])
+        out.write(payload[100:])
+    assert gzip.decompress(f.getvalue()) == payload
+
+
+def test_pgzip_empty():
+    f = io.BytesIO()
+    with compression.compressed(f, "pgzip", 1):
+        pass
+    assert gzip.decompress(f.getvalue()) == b""
+
+
+def test_invalid_level():
+    with pytest.raises(ValueError):
+        with compression.compressed(io.BytesIO(), "gzip", 12):
+            pass
+
+
+def test_zstd_roundtrip(tmp_path, payload):
+    pytest.importorskip("zstandard")
+    archive = tmp_path / "archive.tar.zst"
+    with archive.open("wb") as f, compression.compressed(f, "zstd") as out:
+        with tarfile.open(fileobj=out, mode="w|") as tar:
+            info = tarfile.TarInfo("db.dump")
+            info.size = len(payload)
+            tar.addfile(info, io.BytesIO(payload))
+    assert file_type(str(archive)) == "zstdtar"
+    shutil.unpack_archive(str(archive), str(tmp_path / "out"), "zstdtar")
+    assert (tmp_path / "out" / "db.dump").read_bytes() == payload
@@ -1,10 +1,20 @@
+import io
 import logging
 import shutil
+import tarfile
+import threading
 from datetime import datetime
 from pathlib import Path
 
 import pytest
-from dodoo_backup import FolderStructureUnkown, __version__, _extracted, backup, restore
+from dodoo_backup import (
+    FolderStructureUnkown,
+    __version__,
+    _extracted,
+    _write_archive,
+    backup,
+    restore,
+)
 from dodoo_init import init
 
 
@@ -12,12 +22,32 @@ def test_version():
     assert __version__ == "0.1.0"
 
 
+def test_write_archive_filestore_fails(mocker):
+    archiving = threading.Event()
+    dumped = []
+
+    def backup_database(dbname, dump, **kwargs):
+        archiving.wait(5)
+        dumped.append(dump.parent.exists())
+
+    def archive_filestore(*args):
+        archiving.set()
+        raise OSError("filestore")
+
+    mocker.patch("dodoo_backup.dbutils.backup_database", backup_database)
+    mocker.patch("dodoo_backup.odooutils.archive_filestore", archive_filestore)
+    with pytest.raises(OSError, match="filestore"):
+        _write_archive(io.BytesIO(), "db", True)
+    # The dump's directory outlived it
+    assert dumped == [True]
+
+
 @pytest.fixture
 def init_odoo(db, newdb, main_loaded):
     modules = ["base"]
     with_demo = True
     no_cache = False
-    init(modules, with_demo, no_cache, newdb)
+    init(modules, with_demo, no_cache, [newdb])
     yield newdb
 
 
@@ -43,8 +73,24 @@ def test_backup_restore(bkpdir, tmp_path, init_odoo, newdb2, caplog, mocker):
     archive = backup(filestore_include=True, dbname=init_odoo, dest=bkpdir)
     assert archive.parent == bkpdir
     assert datetime.isoformat(now, timespec="seconds") in str(archive)
+    with tarfile.open(archive) as tar:
+        assert "db.dump" in tar.getnames()
+        assert "filestore" in tar.getnames()
     caplog.clear()
 
+    # Stream without filestore, compressed on all cores
+    stream = io.BytesIO()
+    assert not backup(
+        filestore_include=False,
+        dbname=init_odoo,
+        dest=None,
+        stream=stream,
+        codec="pgzip",
+    )
+    stream.seek(0)
+    with tarfile.open(fileobj=stream) as tar:
+        assert tar.getnames() == ["db.dump"]
+
     dbname = newdb2
     # Restore normally
     restore(clear=False, dbname=dbname, src=archive)
@@ -72,6 +118,37 @@ def test_backup_restore(bkpdir, tmp_path, init_odoo, newdb2, caplog, mocker):
     assert f"Database & filestore {dbname} restored." in caplog.text
     caplog.clear()
 
+    # Restore from a (non-seekable) stream, such as stdin
+    with archive.open("rb") as f:
+        restore(clear=True, dbname=dbname, src=None, stream=f)
+    assert f"Database & filestore {dbname} restored." in caplog.text
+    caplog.clear()
+
+    # Directory format, dumped and restored in parallel jobs
+    dirarchive = backup(
+        filestore_include=True,
+        dbname=init_odoo,
+        dest=tmp_path,
+        dump_format="directory",
+        jobs=2,
+    )
+    with tarfile.open(dirarchive) as tar:
+        assert "db.dump/toc.dat" in tar.getnames()
+    restore(clear=True, dbname=dbname, src=dirarchive, jobs=2)
+    assert f"Database & filestore {dbname} restored." in caplog.text
+    caplog.clear()
+
+    # Incremental, into a repository sharing the filestore blobs
+    repo = tmp_path / "repository"
+    snapshot = backup(
+        filestore_include=True, dbname=init_odoo, dest=repo, incremental=True
+    )
+    assert (snapshot / "manifest.json").exists()
+    assert (repo / "blobs").exists()
+    restore(clear=True, dbname=dbname, src=snapshot)
+    assert f"Database & filestore {dbname} restored." in caplog.text
+    caplog.clear()
+
     # Ensure corrupted archives fail before deleting target database.
     with _extracted(archive) as dir:
         db_bkp = dir / "db.dump"
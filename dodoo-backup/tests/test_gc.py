@@ -0,0 +1,59 @@
+import os
+import time
+from datetime import timedelta
+
+from dodoo_backup import gc
+
+SHA_A = "ab" + "0" * 38
+SHA_B = "ab" + "1" * 38
+SHA_C = "cd" + "2" * 38
+
+
+def _blob(fs, sha, age=0):
+    path = fs / sha[:2] / sha
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(sha)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_fname_index():
+    index = gc.FnameIndex()
+    for fname in sorted([f"{SHA_C[:2]}/{SHA_C}", f"{SHA_A[:2]}/{SHA_A}", "custom"]):
+        index.add(fname)
+    assert len(index) == 3
+    assert f"{SHA_A[:2]}/{SHA_A}" in index
+    assert f"{SHA_C[:2]}/{SHA_C}" in index
+    assert f"{SHA_B[:2]}/{SHA_B}" not in index
+    assert "custom" in index
+    assert "other" not in index
+
+
+def test_orphans(tmp_path):
+    fs = tmp_path / "filestore"
+    day = timedelta(days=1).total_seconds()
+    _blob(fs, SHA_A, age=2 * day)
+    orphan = _blob(fs, SHA_B, age=2 * day)
+    _blob(fs, SHA_C)  # recent, spared
+    (fs / "checklist").mkdir()
+    index = gc.FnameIndex()
+    index.add(f"{SHA_A[:2]}/{SHA_A}")
+    orphans = list(gc._orphans(fs, index, time.time() - day))
+    assert orphans == [(orphan, 40)]
+
+
+def test_remove_rechecks_under_lock(tmp_path, mocker):
+    fs = tmp_path / "filestore"
+    reused = _blob(fs, SHA_A)
+    orphan = _blob(fs, SHA_B)
+    mocker.patch("dodoo_backup.gc.dbutils.database_dsn")
+    cursor = mocker.patch("dodoo_backup.gc.OdooCursor")
+    cr = cursor.return_value.__enter__.return_value
+    # Referenced by an attachment created since the index was built
+    cr.fetchall.return_value = [(f"{SHA_A[:2]}/{SHA_A}",)]
+    assert gc._remove("db", [(reused, 40), (orphan, 40)]) == (1, 40)
+    assert cr.execute.call_args_list[0][0][0].startswith("LOCK TABLE ir_attachment")
+    assert reused.exists()
+    assert not orphan.exists()
@@ -13,7 +13,10 @@ from dodoo.utils import odoo as odooutils
 from dodoo.utils import ensure_framework
 from dodoo.utils import db as dbutils
 
-from typing import List
+from pathlib import Path
+from typing import List, Optional
+
+from .transform import load_transform, transform as _transform
 
 _log = logging.getLogger(__name__)
 
@@ -27,11 +30,25 @@ def install_modules(modules: List[str], dbname: str) -> None:
     _log.info(msg)
 
 
-def copy(modules: List[str], force_disconnect: bool, from_db: str, new_db: str) -> None:
-    """ Create an Odoo database by copying an existing one.
+def copy(
+    modules: List[str],
+    force_disconnect: bool,
+    from_db: str,
+    new_db: str,
+    online: bool = False,
+    jobs: Optional[int] = None,
+    transform: Optional[Path] = None,
+) -> None:
+    """Create an Odoo database by copying an existing one.
 
     This script copies using postgres CREATEDB WITH TEMPLATE.
     It also copies the filestore.
+
+    Online copies stream pg_dump into pg_restore in parallel jobs instead,
+    without disconnecting any user from the source database.
+
+    A transform file declares per model rules (truncate, sample, mask,
+    drop_attachments), which are applied to the copy right after cloning.
     """
     new_exists = dbutils.db_exists(new_db)
     if new_exists:
@@ -43,19 +60,40 @@ def copy(modules: List[str], force_disconnect: bool, from_db: str, new_db: str)
         msg = f"Source database {from_db} does not exist."
         _log.error(msg)
         return
-    if force_disconnect:
-        count = dbutils.terminate_connections(from_db)
-        if count:
-            msg = f"Disconnected {count} active connections from '{new_db}'."
-            _log.warning(msg)
-    dbutils.copy_db(from_db, new_db)
-    odooutils.copy_filestore(from_db, new_db)
-
-    msg = f"Database and filestore copied from {from_db} to {new_db}."
-    _log.info(msg)
+    # Fail early on invalid rules
+    rules = load_transform(transform) if transform else None
+    try:
+        if online:
+            dbutils.stream_copy_db(
+                from_db,
+                new_db,
+                jobs,
+                # Once the snapshot is taken, all of its attachments' blobs exist
+                alongside=lambda: odooutils.copy_filestore(from_db, new_db, jobs),
+            )
+        else:
+            if force_disconnect:
+                count = dbutils.terminate_connections(from_db)
+                if count:
+                    msg = f"Disconnected {count} active connections from '{new_db}'."
+                    _log.warning(msg)
+            dbutils.copy_db(from_db, new_db)
+            odooutils.copy_filestore(from_db, new_db, jobs)
+
+        msg = f"Database and filestore copied from {from_db} to {new_db}."
+        _log.info(msg)
+
+        if rules:
+            _transform(new_db, rules)
 
-    if modules:
-        install_modules(modules, new_db)
+        if modules:
+            install_modules(modules, new_db)
+    except BaseException:
+        # Leave nothing behind a retry would stumble upon, nor untransformed data
+        if dbutils.db_exists(new_db):
+            dbutils.drop_database(new_db)
+        odooutils.drop_filestore(new_db)
+        raise
 
 
 if __name__ == "__main__":  # pragma: no cover
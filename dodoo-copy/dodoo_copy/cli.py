@@ -6,6 +6,7 @@
 """This module implements the cli subcommand for dodoo copy"""
 
 import click
+import click_pathlib
 from dodoo_copy import __version__, copy as _copy
 
 from dodoo.cli import CONTEXT_SETTINGS, EPILOG
@@ -26,10 +27,32 @@ from dodoo.cli import CONTEXT_SETTINGS, EPILOG
     is_flag=True,
     help="Attempt to disconnect users from the template database.",
 )
+@click.option(
+    "--online",
+    is_flag=True,
+    help="Stream the copy through pg_dump / pg_restore, without disconnecting "
+    "users from the source database.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Parallel jobs of an online copy (default: one per core) and of the "
+    "filestore copy.",
+)
+@click.option(
+    "--transform",
+    "-t",
+    type=click_pathlib.Path(exists=True, dir_okay=False, resolve_path=True),
+    help="Json file of per model rules to truncate, sample, mask or drop "
+    "attachments in the copy.",
+)
 @click.argument("from-db", required=True)
 @click.argument("new-db", required=True)
 @click.version_option(version=__version__)
 def copy(*args, **kwargs):
+    if kwargs["online"] and kwargs["force_disconnect"]:
+        raise click.UsageError("Online copies don't need to disconnect users.")
     _copy(*args, **kwargs)
 
 
@@ -0,0 +1,208 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the dodoo copy transform stage
+
+Rules are declared per model in a json file, for example:
+
+    {
+        "models": {
+            "mail.mail": {"truncate": true},
+            "mail.message": {"sample": 10},
+            "res.partner": {
+                "mask": {"email": "partner-{id}@example.com", "phone": null}
+            },
+            "account.move": {"drop_attachments": true}
+        }
+    }
+
+They are applied with set-based SQL in the freshly copied database. Sampling
+keeps the records which are referenced by a RESTRICT / NO ACTION foreign key.
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from mashumaro import DataClassDictMixin
+from psycopg2 import errors, sql
+
+from dodoo.connections import AutocommitConnection, OdooCursor
+from dodoo.interfaces import odoo
+from dodoo.utils import db as dbutils
+from dodoo.utils import ensure_framework
+
+_log = logging.getLogger(__name__)
+
+
+class InvalidTransformError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ModelRule(DataClassDictMixin):
+    # Remove all records (CASCADE: also those of referencing tables)
+    truncate: bool = False
+    # Keep (about) N percent of the records, and those which can't be deleted
+    sample: Optional[float] = None
+    # Column -> replacement, "{id}" is substituted; null clears the column
+    mask: Dict[str, Optional[str]] = field(default_factory=dict)
+    # Remove the attachments of the model's records
+    drop_attachments: bool = False
+    # Defaults to odoo's table name convention
+    table: Optional[str] = None
+
+    def __post_init__(self):
+        if self.sample is not None and not 0 <= self.sample <= 100:
+            raise InvalidTransformError(f"Sample {self.sample} is no percentage.")
+
+
+@dataclass(frozen=True)
+class Transform(DataClassDictMixin):
+    models: Dict[str, ModelRule] = field(default_factory=dict)
+
+
+def load_transform(file: Path) -> Transform:
+    try:
+        data = json.loads(file.read_text())
+    except ValueError as e:
+        raise InvalidTransformError(f"{file} is no valid json: {e}")
+    known = {f.name for f in fields(ModelRule)}
+    for model, rule in data.get("models", {}).items():
+        unknown = set(rule) - known
+        if unknown:
+            raise InvalidTransformError(f"Unknown rules for {model}: {unknown}")
+    return Transform.from_dict(data)
+
+
+RESTRICTING_FKS_QUERY = """
+    SELECT n.nspname, r.relname,
+        array(
+            SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY k(attnum, i)
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+            ORDER BY k.i
+        ),
+        array(
+            SELECT a.attname FROM unnest(c.confkey) WITH ORDINALITY k(attnum, i)
+            JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum
+            ORDER BY k.i
+        )
+    FROM pg_constraint c
+    JOIN pg_class r ON r.oid = c.conrelid
+    JOIN pg_namespace n ON n.oid = r.relnamespace
+    WHERE c.contype = 'f' AND c.confrelid = %s::regclass
+    AND c.confdeltype IN ('r', 'a')
+    ORDER BY 1, 2, c.conname
+"""
+
+
+def _sample(cr, model: str, table: str, percent: float) -> None:
+    """Delete about 100 - percent of the records, except those which a
+    RESTRICT or NO ACTION foreign key references."""
+    cr.execute(RESTRICTING_FKS_QUERY, (table,))
+    clauses = []
+    for schema, referencing, columns, referenced in cr.fetchall():
+        join = sql.SQL(" AND ").join(
+            sql.SQL("r.{} = t.{}").format(sql.Identifier(c), sql.Identifier(f))
+            for c, f in zip(columns, referenced)
+        )
+        clauses.append(
+            sql.SQL("AND NOT EXISTS (SELECT 1 FROM {} r WHERE {})").format(
+                sql.Identifier(schema, referencing), join
+            )
+        )
+    try:
+        cr.execute(
+            sql.SQL("DELETE FROM {} t WHERE random() * 100 >= %s {}").format(
+                sql.Identifier(table), sql.SQL(" ").join(clauses)
+            ),
+            (percent,),
+        )
+    except errors.ForeignKeyViolation as e:
+        # Eg. cascading into a table which is referenced in turn
+        raise InvalidTransformError(
+            f"Can't sample {model}, deleting its records violates a foreign "
+            f"key: {str(e).strip()}"
+        )
+
+
+def _apply_rule(cr, model: str, rule: ModelRule) -> Set[str]:
+    """Apply one model's rule, return the fnames of deleted attachments."""
+    table = sql.Identifier(rule.table or model.replace(".", "_"))
+    cr.execute("SELECT to_regclass(%s)", (rule.table or model.replace(".", "_"),))
+    if not cr.fetchone()[0]:
+        msg = f"Transform skipped model {model}, it has no table."
+        _log.warning(msg)
+        return set()
+    if rule.truncate:
+        cr.execute(sql.SQL("TRUNCATE {} CASCADE").format(table))
+    elif rule.sample is not None:
+        _sample(cr, model, rule.table or model.replace(".", "_"), rule.sample)
+    for column, replacement in rule.mask.items():
+        cr.execute(
+            sql.SQL(
+                "UPDATE {table} SET {column} = replace(%s, '{{id}}', id::text) "
+                "WHERE {column} IS NOT NULL"
+            ).format(table=table, column=sql.Identifier(column)),
+            (replacement,),
+        )
+    if rule.drop_attachments:
+        cr.execute(
+            "DELETE FROM ir_attachment WHERE res_model = %s RETURNING store_fname",
+            (model,),
+        )
+    elif rule.truncate or rule.sample is not None:
+        # Attachments of removed records
+        cr.execute(
+            sql.SQL(
+                "DELETE FROM ir_attachment a WHERE a.res_model = %s "
+                "AND a.res_id IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM {} t WHERE t.id = a.res_id) "
+                "RETURNING store_fname"
+            ).format(table),
+            (model,),
+        )
+    else:
+        return set()
+    msg = f"Transformed {model}, dropping {cr.rowcount} attachments."
+    _log.info(msg)
+    return {fname for (fname,) in cr.fetchall() if fname}
+
+
+@ensure_framework
+def transform(dbname: str, rules: Transform) -> None:
+    """Apply the transform rules to a (copied) database in one transaction,
+    then remove the dropped attachments' blobs from its filestore."""
+    dsn = dbutils.database_dsn(dbname)
+    dropped = set()
+    with OdooCursor(dsn) as cr:
+        for model, rule in rules.models.items():
+            dropped |= _apply_rule(cr, model, rule)
+        # Blobs might be shared with remaining attachments
+        cr.execute(
+            "SELECT DISTINCT store_fname FROM ir_attachment "
+            "WHERE store_fname = ANY(%s)",
+            (list(dropped),),
+        )
+        dropped -= {fname for (fname,) in cr.fetchall()}
+    fs = odoo.Config().filestore(dbname)
+    for fname in dropped:
+        blob = fs / fname
+        if blob.exists():
+            blob.unlink()
+    # Reclaim the space: this is a fresh copy, nobody minds the locks
+    conn = AutocommitConnection(dsn, "odoo")
+    with conn:
+        with conn.conn.cursor() as cr:
+            for model, rule in rules.models.items():
+                table = rule.table or model.replace(".", "_")
+                cr.execute("SELECT to_regclass(%s)", (table,))
+                if cr.fetchone()[0]:
+                    cr.execute(
+                        sql.SQL("VACUUM FULL ANALYZE {}").format(sql.Identifier(table))
+                    )
+    msg = f"Database {dbname} transformed, {len(dropped)} blobs removed."
+    _log.info(msg)
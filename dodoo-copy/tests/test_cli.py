@@ -6,6 +6,10 @@ COPY_ARGS_A = "existingdb newdb"
 # might distrub users temporarily
 COPY_ARGS_B = "--force-disconnect existingdb newdb"
 COPY_ARGS_C = "-i web -i account --force-disconnect existingdb newdb"
+# doesn't disturb users
+COPY_ARGS_D = "--online -j 4 existingdb newdb"
+COPY_ARGS_E = "--transform README.md existingdb newdb"
+COPY_ARGS_FAULTY_A = "--online --force-disconnect existingdb newdb"
 
 
 def test_copy_help():
@@ -23,3 +27,11 @@ def test_copy(mocker):
     assert result.exit_code == 0
     result = runner.invoke(copy, COPY_ARGS_C.split())
     assert result.exit_code == 0
+    result = runner.invoke(copy, COPY_ARGS_D.split())
+    assert result.exit_code == 0
+    with runner.isolated_filesystem():
+        open("README.md", "w").close()
+        result = runner.invoke(copy, COPY_ARGS_E.split())
+        assert result.exit_code == 0
+    result = runner.invoke(copy, COPY_ARGS_FAULTY_A.split())
+    assert result.exit_code == 2
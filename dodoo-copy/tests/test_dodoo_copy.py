@@ -1,7 +1,9 @@
+import json
 import logging
 
 import pytest
 from dodoo_copy import __version__, copy
+from dodoo_copy.transform import InvalidTransformError
 from dodoo_init import init
 
 
@@ -9,12 +11,30 @@ def test_version():
     assert __version__ == "0.1.0"
 
 
+@pytest.mark.parametrize("failing", ["stream_copy_db", "transform"])
+def test_copy_failed_cleanup(mocker, failing):
+    dbutils = mocker.patch("dodoo_copy.dbutils")
+    odooutils = mocker.patch("dodoo_copy.odooutils")
+    mocker.patch("dodoo_copy.load_transform")
+    transform = mocker.patch("dodoo_copy._transform")
+    # dest missing, source present, dest partially created
+    dbutils.db_exists.side_effect = [False, True, True]
+    if failing == "transform":
+        transform.side_effect = InvalidTransformError("restricted")
+    else:
+        dbutils.stream_copy_db.side_effect = RuntimeError("pg_restore")
+    with pytest.raises((RuntimeError, InvalidTransformError)):
+        copy([], False, "db", "newdb", online=True, transform="rules.json")
+    dbutils.drop_database.assert_called_once_with("newdb")
+    odooutils.drop_filestore.assert_called_once_with("newdb")
+
+
 @pytest.fixture
 def init_odoo(db, newdb, main_loaded):
     modules = ["base"]
     with_demo = True
     no_cache = False
-    init(modules, with_demo, no_cache, newdb)
+    init(modules, with_demo, no_cache, [newdb])
     yield newdb
 
 
@@ -41,3 +61,55 @@ def test_copy_and_install_modules(init_odoo, newdb2, caplog):
     fs_new = odoo.Config().filestore(newdb2)
     for path in fs_from.iterdir():
         assert (fs_new / path).exists()
+
+
+def test_copy_online(init_odoo, newdb2, caplog):
+    caplog.set_level(logging.INFO)
+    copy(
+        modules=[],
+        force_disconnect=False,
+        from_db=init_odoo,
+        new_db=newdb2,
+        online=True,
+        jobs=2,
+    )
+    assert f"Database and filestore copied from {init_odoo} to {newdb2}." in caplog.text
+
+    from dodoo.interfaces import odoo
+
+    fs_from = odoo.Config().filestore(init_odoo)
+    fs_new = odoo.Config().filestore(newdb2)
+    for path in fs_from.iterdir():
+        assert (fs_new / path).exists()
+
+
+def test_copy_transform(init_odoo, newdb2, tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    rules = tmp_path / "transform.json"
+    rules.write_text(
+        json.dumps(
+            {
+                "models": {
+                    "res.partner": {"mask": {"email": "partner-{id}@example.com"}},
+                    "ir.ui.view": {"drop_attachments": True},
+                    "ir.logging": {"truncate": True},
+                }
+            }
+        )
+    )
+    copy(
+        modules=[],
+        force_disconnect=True,
+        from_db=init_odoo,
+        new_db=newdb2,
+        transform=rules,
+    )
+    assert f"Database {newdb2} transformed" in caplog.text
+
+    from dodoo.connections import OdooCursor
+    from dodoo.utils import db as dbutils
+
+    with OdooCursor(dbutils.database_dsn(newdb2)) as cr:
+        cr.execute("SELECT id, email FROM res_partner WHERE email IS NOT NULL")
+        for id, email in cr.fetchall():
+            assert email == f"partner-{id}@example.com"
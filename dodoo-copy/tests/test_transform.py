@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from dodoo_copy.transform import InvalidTransformError, _sample, load_transform
+from psycopg2 import errors
+
+RULES = {
+    "models": {
+        "mail.mail": {"truncate": True},
+        "mail.message": {"sample": 10},
+        "res.partner": {"mask": {"email": "partner-{id}@example.com", "phone": None}},
+        "account.move": {"drop_attachments": True, "table": "account_move"},
+    }
+}
+
+
+def test_load_transform(tmp_path):
+    file = tmp_path / "transform.json"
+    file.write_text(json.dumps(RULES))
+    rules = load_transform(file)
+    assert rules.models["mail.mail"].truncate
+    assert rules.models["mail.message"].sample == 10
+    assert rules.models["res.partner"].mask["phone"] is None
+    assert rules.models["account.move"].drop_attachments
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "{not json",
+        json.dumps({"models": {"res.partner": {"truncat": True}}}),
+        json.dumps({"models": {"res.partner": {"sample": 200}}}),
+    ],
+)
+def test_load_transform_invalid(tmp_path, content):
+    file = tmp_path / "transform.json"
+    file.write_text(content)
+    with pytest.raises(InvalidTransformError):
+        load_transform(file)
+
+
+def test_sample_keeps_restricted(mocker):
+    cr = mocker.Mock()
+    cr.fetchall.return_value = [("public", "res_users", ["partner_id"], ["id"])]
+    _sample(cr, "res.partner", "res_partner", 10)
+    query, params = cr.execute.call_args_list[-1][0]
+    assert params == (10,)
+    # Composed of DELETE ... NOT EXISTS (... res_users r WHERE r.partner_id = t.id)
+    assert "NOT EXISTS" in repr(query)
+    assert "'res_users'" in repr(query)
+
+
+def test_sample_violation(mocker):
+    cr = mocker.Mock()
+    cr.fetchall.return_value = []
+    cr.execute.side_effect = [None, errors.ForeignKeyViolation("violates")]
+    with pytest.raises(InvalidTransformError, match="res.partner"):
+        _sample(cr, "res.partner", "res_partner", 10)
@@ -9,25 +9,31 @@ __version__ = "0.1.0"
 import csv
 import hashlib
 import logging
-import os
+import time
 from datetime import timedelta
-from pathlib import Path
 from dodoo.utils import odoo as odooutils
 from dodoo.utils import db as dbutils
 from dodoo.utils import ensure_framework
+from dodoo.catalog import module_graph
 from dodoo.interfaces import odoo
 
-from typing import List, Tuple
+from pathlib import Path
+from typing import List
 
 from .patchers.odoo import AttachmentStoragePatcher
 
 from .cache import DbCache
+from .digest import FileDigestCache
 
 _log = logging.getLogger(__name__)
 
 
-EXCLUDE_PATTERNS = ("*.pyc", "*.pyo")
 CACHE_PREFIX = "cache"
+DIGEST_CACHE_FILE = "dodoo-init/digest-cache.json"
+
+
+class ClonesNotCreatedError(Exception):
+    pass
 
 
 @ensure_framework
@@ -51,75 +57,108 @@ def odoo_createdb(dbname: str, with_demo: bool, modules: List[str]):
     odoo.Database().close_all()
 
 
-def _walk(top: str, exclude_patterns: Tuple[str] = EXCLUDE_PATTERNS) -> Path:
-    """ Visit all files excluding specified patterns."""
-    for root, dirnames, filenames in os.walk(top):
-        root = Path(root)
-        reltop = root.relative_to(top)
-        dirnames.sort()
-        for fname in sorted(filenames):
-            fpath = reltop / fname
-            for exclude_pattern in exclude_patterns:
-                if not fpath.match(exclude_pattern):
-                    yield fpath
-
-
-def addons_digest(modules: List[str], with_demo: bool) -> bytes:
+def addons_digest(modules: List[str], with_demo: bool) -> str:
     """ Calculate digest of the source files of installable modules.
-    Differenciate between demo and non-demo initializations."""
+    Differenciate between demo and non-demo initializations.
+
+    Modules are content hashed concurrently and per-file digests are cached
+    under the data dir, so that only changed files are read again."""
     h = hashlib.sha1()
     h.update(f"!demo={with_demo:d}!".encode())
-    for module in odooutils.expand_dependencies(modules):
-        h.update(module.encode())
-        module_path = odoo.Modules().module_path_from(module)
+    modules = odooutils.expand_dependencies(modules)
+    # Resolved along with the dependencies
+    graph = module_graph()
+    module_paths = [Path(graph.modules[module].path) for module in modules]
+    digest_cache = FileDigestCache(odoo.Config().data_dir() / DIGEST_CACHE_FILE)
+    for module, digest in zip(modules, digest_cache.digests(module_paths)):
         _log.debug(f"Content hashing module: '{module}'")
-        for fpath in _walk(module_path):
-            h.update(str(fpath).encode())
-            h.update((module_path / fpath).read_bytes())
+        h.update(module.encode())
+        h.update(digest.encode())
+    digest_cache.save()
     return h.hexdigest()
 
 
-def init(modules: List[str], with_demo: bool, no_cache: bool, database: str) -> None:
-    """ Create an Odoo database with pre-installed modules.
+def init(
+    modules: List[str],
+    with_demo: bool,
+    no_cache: bool,
+    databases: List[str],
+    spares: int = 0,
+) -> None:
+    """ Create Odoo databases with pre-installed modules.
 
     This script manages a cache of database templates with the exact same
-    addons installed.
+    addons installed. All databases are created from a single digest and
+    template build.
 
     Cache Keys:
         Templates are identified by computing a sha1 checksum over a file walk
         of the provided modules including their dependencies and corresponding
         auto installed modules.
+
+    Spares:
+        Optionally, spare clones of a hit template are kept ready, so that
+        subsequent hits only need to rename a database.
     """
 
     # See commit 68f14c68709bbb50cb7fb66d288955e1d769c5ff in odoo/odoo
     csv.field_size_limit(500 * 1024 * 1024)
 
     if no_cache:
-        odoo_createdb(database, with_demo, modules)
+        for database in databases:
+            odoo_createdb(database, with_demo, modules)
+        return
 
     digest = addons_digest(modules, with_demo)
     dsn = dbutils.maintenance_dsn()
-    with DbCache(dsn, CACHE_PREFIX) as dbcache:
-        created = dbcache.create(database, digest)
+    with DbCache(dsn, CACHE_PREFIX, spares) as dbcache:
+        created = dbcache.create_many(databases, digest)
         if created:
-            odoo.Modules().reflect(database)
-            msg = f"New database '{database}' created from db cache."
-            _log.info(msg)
+            for database in databases:
+                odoo.Modules().reflect(database)
+                msg = f"New database '{database}' created from db cache."
+                _log.info(msg)
         else:
+            database, *clones = databases
             AttachmentStoragePatcher().apply()
+            start = time.monotonic()
             odoo_createdb(database, with_demo, modules)
-            dbcache.add(database, digest)
+            dbcache.add(database, digest, build_time=time.monotonic() - start)
             msg = f"Database '{database}' put in db cache."
             _log.info(msg)
-
-
-def trim_cache(max_age: int, max_size: int) -> None:
+            if clones and not dbcache.create_many(clones, digest):
+                # Evicted in between, eg. by a concurrent trim
+                msg = f"Template of '{database}' evicted before cloning {clones}."
+                _log.error(msg)
+                raise ClonesNotCreatedError(clones)
+            for clone in clones:
+                odoo.Modules().reflect(clone)
+                msg = f"New database '{clone}' created from db cache."
+                _log.info(msg)
+
+
+def trim_cache(
+    max_age: int, max_size: int, max_bytes: int = None, policy: str = "lru"
+) -> None:
     """ Trim the odoo database cache.
+
+    Eviction Policies:
+        lru: evict least recently used templates first.
+        lfu: evict least frequently used templates first.
+        cost: evict templates with the lowest build time times hits per byte
+        first, keeping those most expensive to rebuild.
     """
     dsn = dbutils.maintenance_dsn()
     with DbCache(dsn, CACHE_PREFIX) as dbcache:
+        if max_bytes is not None:
+            count = dbcache.trim_bytes(max_bytes, policy)
+            if count:
+                msg = f"{count} database(s) cleared from cache (max-bytes)."
+            else:
+                msg = f"No database cleared from cache (max-bytes)."
+            _log.info(msg)
         if max_size is not None:
-            count = dbcache.trim_size(max_size)
+            count = dbcache.trim_size(max_size, policy)
             if count:
                 msg = f"{count} database(s) cleared from cache (max-size)."
             else:
@@ -8,67 +8,176 @@
 import contextlib
 import hashlib
 import logging
+import os
+import queue
+import re
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-from dodoo.connections import AutocommitConnection
+import psycopg2
+
+from dodoo.configs.db import DbConfig
+from dodoo.connections import POOL, AutocommitConnection
 
 _log = logging.getLogger(__name__)
 
 
+# Sort keys of (template, hashsum, last_used, hits, build_time, size) rows,
+# ordering templates from the first to the last to be evicted.
+EVICTION_POLICIES = {
+    "lru": lambda r: r[2],
+    "lfu": lambda r: (r[3], r[2]),
+    # Keep what is expensive to rebuild and often used per byte of disk; new
+    # templates count as one hit to not evict them straight away.
+    "cost": lambda r: ((r[4] or 0) * (r[3] + 1) / max(r[5], 1), r[2]),
+}
+
+
 class DbCache(AutocommitConnection):
     """ Manage a cache of db templates.
 
-    Templates are named prefix-YYYYmmddHHMM-hashsum, where
-    YYYYmmddHHMM is the date and time when the given hashsum has last been
-    used for that prefix.
+    Templates are named prefix-hashsum. Their metadata (creation and last
+    usage date, hit count, build time and size) is recorded in a table of the
+    dodoo schema and each hashsum is locked on its own, so that inits of
+    different module sets never block each other. Templates named
+    prefix-YYYYmmddHHMM-hashsum by earlier versions are tracked once seen.
+
+    Optionally, a number of spare clones is kept ready per template. They are
+    named prefix-spare-hashsum-token, with a truncated hashsum and a random
+    token. A cache hit then only renames a spare, which is refilled by a
+    detached process, outliving the one which hit the cache.
     """
 
     HASH_SIZE = hashlib.sha1().digest_size * 2
-    MAX_HASHSUM = "f" * HASH_SIZE
+    SPARE_HASH_SIZE = 32
+    # Connections used to clone several databases concurrently
+    POOL_SIZE = 4
+    TABLE = f"{DbConfig.dodoo_schema}.init_cache"
 
-    def __init__(self, dsn, prefix):
+    def __init__(self, dsn, prefix, spares=0):
         super().__init__(dsn)
         self.prefix = prefix
-        self.lock_id = self._make_lock_id()
+        self.spares = spares
+        self._refills = []
 
     def __enter__(self):
         super().__enter__()
         self.cr = self.conn.cursor()
+        self._ensure_table()
+        self._track_legacy_templates()
         return self
 
-    def _make_lock_id(self):
-        # try to make a unique lock id based on the cache prefix
+    def _make_lock_id(self, hashsum=None):
+        # try to make a unique lock id based on the cache prefix and hashsum
         h = hashlib.sha1()
         h.update(self.prefix.encode("utf8"))
+        if hashsum:
+            h.update(hashsum.encode("utf8"))
         return int(h.hexdigest()[:14], 16)
 
     @contextlib.contextmanager
-    def _lock(self):
-        self.cr.execute("SELECT pg_advisory_lock(%s::bigint)", (self.lock_id,))
+    def _lock(self, hashsum=None):
+        lock_id = self._make_lock_id(hashsum)
+        self.cr.execute("SELECT pg_advisory_lock(%s::bigint)", (lock_id,))
         try:
             yield
         finally:
-            self.cr.execute("SELECT pg_advisory_unlock(%s::bigint)", (self.lock_id,))
+            self.cr.execute("SELECT pg_advisory_unlock(%s::bigint)", (lock_id,))
 
-    def _make_pattern(self, dt=None, hs=None):
-        if dt:
-            dtpart = dt.strftime("%Y%m%d%H%M")
-        else:
-            dtpart = "_" * 12
-        if hs:
-            hspart = hs
-        else:
-            hspart = "_" * self.HASH_SIZE
-        pattern = self.prefix + "-" + dtpart + "-" + hspart
+    @contextlib.contextmanager
+    def _try_lock(self, hashsum):
+        lock_id = self._make_lock_id(hashsum)
+        self.cr.execute("SELECT pg_try_advisory_lock(%s::bigint)", (lock_id,))
+        (locked,) = self.cr.fetchone()
+        try:
+            yield locked
+        finally:
+            if locked:
+                self.cr.execute("SELECT pg_advisory_unlock(%s::bigint)", (lock_id,))
+
+    def _ensure_table(self):
+        self.cr.execute("SELECT to_regclass(%s)", (self.TABLE,))
+        if self.cr.fetchone()[0]:
+            return
+        # Concurrent `CREATE ... IF NOT EXISTS` may still collide
+        with self._lock():
+            self.cr.execute(
+                f"""
+                CREATE SCHEMA IF NOT EXISTS {DbConfig.dodoo_schema};
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    prefix varchar NOT NULL,
+                    hashsum varchar NOT NULL,
+                    template varchar NOT NULL UNIQUE,
+                    created timestamp NOT NULL,
+                    last_used timestamp NOT NULL,
+                    hits integer NOT NULL DEFAULT 0,
+                    build_time double precision,
+                    size bigint,
+                    PRIMARY KEY (prefix, hashsum)
+                );
+            """
+            )
+
+    def _track_legacy_templates(self):
+        """ Register untracked templates of earlier versions, so that they are
+        hit, trimmed and purged like the others """
+        self.cr.execute(
+            f"""
+            SELECT d.datname FROM pg_database d
+            WHERE d.datname LIKE %s AND NOT EXISTS (
+                SELECT 1 FROM {self.TABLE} c WHERE c.template = d.datname
+            )
+        """,
+            (f"{self.prefix}-%",),
+        )
+        legacy = re.compile(rf"{re.escape(self.prefix)}-(\d{{12}})-([0-9a-f]+)")
+        for (datname,) in self.cr.fetchall():
+            match = legacy.fullmatch(datname)
+            if not match:
+                continue
+            created = datetime.strptime(match.group(1), "%Y%m%d%H%M")
+            hashsum = match.group(2)
+            with self._lock(hashsum):
+                template_name = self._find_template(hashsum)
+                if template_name == datname:
+                    continue  # Tracked concurrently
+                if template_name:
+                    # Superseded by a template of this version
+                    self._drop_db(datname)
+                    continue
+                self.cr.execute(
+                    f"""
+                    INSERT INTO {self.TABLE}
+                        (prefix, hashsum, template, created, last_used, size)
+                    VALUES (%s, %s, %s, %s, %s, pg_database_size(%s))
+                    ON CONFLICT (prefix, hashsum) DO UPDATE
+                    SET template = EXCLUDED.template,
+                        created = EXCLUDED.created,
+                        last_used = EXCLUDED.last_used,
+                        hits = 0,
+                        build_time = NULL,
+                        size = EXCLUDED.size
+                """,
+                    (self.prefix, hashsum, datname, created, created, datname),
+                )
+
+    def _make_template_name(self, hashsum):
         # 63 is max postgres db name, so we may truncate the hash part
-        return pattern[:63]
+        return f"{self.prefix}-{hashsum}"[:63]
+
+    def _make_spare_pattern(self, hashsum=None, token=None):
+        hspart = hashsum[: self.SPARE_HASH_SIZE] if hashsum else "%"
+        return f"{self.prefix}-spare-{hspart}-{token or '%'}"
 
-    def _make_new_template_name(self, hashsum):
-        return self._make_pattern(dt=datetime.utcnow(), hs=hashsum)
+    def _make_new_spare_name(self, hashsum):
+        return self._make_spare_pattern(hashsum, uuid.uuid4().hex[:8])
 
-    def _create_db_from_template(self, dbname, template):
+    def _create_db_from_template(self, dbname, template, cr=None):
         _log.debug(f"Creating database {dbname} from {template}")
-        self.cr.execute(
+        (cr or self.cr).execute(
             f"""
             CREATE DATABASE "{dbname}"
             ENCODING 'unicode'
@@ -76,6 +185,37 @@ class DbCache(AutocommitConnection):
         """
         )
 
+    def _create_dbs_from_template(self, dbnames, template):
+        if len(dbnames) <= 1:
+            for dbname in dbnames:
+                self._create_db_from_template(dbname, template)
+            return
+        pool = queue.Queue()
+        for _i in range(min(self.POOL_SIZE, len(dbnames))):
+            pool.put(POOL.getconn(self.dsn, autocommit=True))
+        created = []
+
+        def create(dbname):
+            conn = pool.get()
+            try:
+                with conn.cursor() as cr:
+                    self._create_db_from_template(dbname, template, cr)
+                created.append(dbname)
+            finally:
+                pool.put(conn)
+
+        try:
+            # Waits for all clones, also when one fails
+            with ThreadPoolExecutor(max_workers=pool.qsize()) as executor:
+                list(executor.map(create, dbnames))
+        except BaseException:
+            for dbname in created:
+                self._drop_db(dbname)
+            raise
+        finally:
+            while not pool.empty():
+                POOL.putconn(pool.get(), self.dsn)
+
     def _rename_db(self, dbname_from, dbname_to):
         _log.debug(f"Renaming database {dbname_from} to {dbname_to}")
         self.cr.execute(
@@ -89,20 +229,19 @@ class DbCache(AutocommitConnection):
         _log.debug(f"Dropping database {dbname}")
         self.cr.execute(
             f"""
-            DROP DATABASE "{dbname}"
+            DROP DATABASE IF EXISTS "{dbname}"
         """
         )
 
     def _find_template(self, hashsum):
-        """ search same prefix and hashsum, any date """
-        pattern = self.prefix + "-____________-" + hashsum
+        """ search same prefix and hashsum """
         self.cr.execute(
-            """
-            SELECT datname FROM pg_database
-            WHERE datname like %s
-            ORDER BY datname DESC  -- MRU first
+            f"""
+            SELECT c.template FROM {self.TABLE} c
+            JOIN pg_database d ON d.datname = c.template
+            WHERE c.prefix = %s AND c.hashsum = %s
         """,
-            (pattern,),
+            (self.prefix, hashsum),
         )
         r = self.cr.fetchone()
         if r:
@@ -110,96 +249,245 @@ class DbCache(AutocommitConnection):
         else:
             return None
 
-    def _touch(self, template_name, hashsum):
-        # change the template date (MRU mechanism)
-        assert template_name.endswith(hashsum)
-        new_template_name = self._make_new_template_name(hashsum)
-        if template_name != new_template_name:
-            self._rename_db(template_name, new_template_name)
+    def _find_spares(self, hashsum=None):
+        self.cr.execute(
+            """
+            SELECT datname FROM pg_database
+            WHERE datname like %s
+            ORDER BY datname
+        """,
+            (self._make_spare_pattern(hashsum),),
+        )
+        return [datname for (datname,) in self.cr.fetchall()]
+
+    def _drop_spares(self, hashsum=None):
+        for datname in self._find_spares(hashsum):
+            self._drop_db(datname)
+
+    def _drop_template(self, template_name, hashsum):
+        self._drop_db(template_name)
+        self._drop_spares(hashsum)
+        self.cr.execute(
+            f"DELETE FROM {self.TABLE} WHERE prefix = %s AND hashsum = %s",
+            (self.prefix, hashsum),
+        )
+
+    def _touch(self, hashsum, hits=1):
+        # record usage (MRU mechanism) and hits
+        self.cr.execute(
+            f"""
+            UPDATE {self.TABLE} SET last_used = %s, hits = hits + %s
+            WHERE prefix = %s AND hashsum = %s
+        """,
+            (datetime.utcnow(), hits, self.prefix, hashsum),
+        )
+
+    def _register(self, template_name, hashsum, build_time):
+        now = datetime.utcnow()
+        self.cr.execute(
+            f"""
+            INSERT INTO {self.TABLE}
+                (prefix, hashsum, template, created, last_used, build_time, size)
+            VALUES (%s, %s, %s, %s, %s, %s, pg_database_size(%s))
+            ON CONFLICT (prefix, hashsum) DO UPDATE
+            SET template = EXCLUDED.template,
+                created = EXCLUDED.created,
+                last_used = EXCLUDED.last_used,
+                hits = 0,
+                build_time = EXCLUDED.build_time,
+                size = EXCLUDED.size
+        """,
+            (self.prefix, hashsum, template_name, now, now, build_time, template_name),
+        )
 
     def create(self, new_database, hashsum):
         """ Create a new database from a cached template matching hashsum """
-        with self._lock():
+        return self.create_many([new_database], hashsum)
+
+    def create_many(self, new_databases, hashsum):
+        """ Create new databases from a cached template matching hashsum.
+        Spares are used first, remaining databases are cloned concurrently """
+        with self._lock(hashsum):
             template_name = self._find_template(hashsum)
             if not template_name:
                 return False
-            else:
-                self._create_db_from_template(new_database, template_name)
-                self._touch(template_name, hashsum)
-                return True
+            spares = self._find_spares(hashsum)[: len(new_databases)]
+            renamed = []
+            try:
+                for spare, new_database in zip(spares, new_databases):
+                    self._rename_db(spare, new_database)
+                    renamed.append(new_database)
+                self._create_dbs_from_template(
+                    new_databases[len(spares) :], template_name
+                )
+            except BaseException:
+                # All or nothing, a retry would stumble upon existing databases
+                for new_database in renamed:
+                    self._drop_db(new_database)
+                raise
+            self._touch(hashsum, hits=len(new_databases))
+        if self.spares:
+            self._refill_in_background(hashsum)
+        return True
 
-    def add(self, new_database, hashsum):
-        """ Create a new cached template """
-        with self._lock():
+    def add(self, new_database, hashsum, build_time=None):
+        """ Create a new cached template, build_time being the seconds it took
+        to build new_database """
+        with self._lock(hashsum):
             template_name = self._find_template(hashsum)
             if template_name:
-                self._touch(template_name, hashsum)
+                self._touch(hashsum, hits=0)
             else:
-                new_template_name = self._make_new_template_name(hashsum)
+                new_template_name = self._make_template_name(hashsum)
                 self._create_db_from_template(new_template_name, new_database)
+                self._register(new_template_name, hashsum, build_time)
+
+    def refill(self, hashsum):
+        """ Top up the spare clones of the template matching hashsum """
+        count = 0
+        # Copying is slow: don't block other inits, and tolerate concurrent
+        # refills overshooting; trimming takes care of leftovers.
+        template_name = self._find_template(hashsum)
+        if not template_name:
+            return count
+        for _i in range(self.spares - len(self._find_spares(hashsum))):
+            spare_name = self._make_new_spare_name(hashsum)
+            self._create_db_from_template(spare_name, template_name)
+            count += 1
+        return count
+
+    def _refill_in_background(self, hashsum):
+        # Detached, a cache hit returns right away; the dsn may carry
+        # credentials, so it's not passed on the command line. Failures are
+        # reported on the inherited stderr.
+        env = dict(os.environ, DODOO_INIT_CACHE_DSN=self.dsn)
+        args = [sys.executable, "-m", __name__, self.prefix, str(self.spares), hashsum]
+        process = subprocess.Popen(
+            args,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self._refills.append(process)
+
+    def wait(self):
+        """ Wait for background refills started by this instance to finish,
+        eg. in tests """
+        while self._refills:
+            self._refills.pop().wait()
+
+    def _evict(self, template_name, hashsum, blocking=False):
+        """ Drop a template, skip it if in use unless blocking """
+        if blocking:
+            with self._lock(hashsum):
+                self._drop_template(template_name, hashsum)
+            return True
+        with self._try_lock(hashsum) as locked:
+            if not locked:
+                _log.debug(f"Template {template_name} in use, not evicted.")
+                return False
+            self._drop_template(template_name, hashsum)
+            return True
+
+    def _ranked(self, policy):
+        """ Return (template, hashsum, last_used, hits, build_time, size) rows,
+        from the first to the last to be evicted under policy. Size is the
+        current on-disk size of the template and its spares. """
+        self.cr.execute(
+            f"""
+            SELECT c.template, c.hashsum, c.last_used, c.hits, c.build_time,
+                (pg_database_size(d.datname) + (
+                    SELECT coalesce(sum(pg_database_size(s.datname)), 0)
+                    FROM pg_database s
+                    WHERE s.datname LIKE c.prefix || '-spare-'
+                        || left(c.hashsum, %s) || '-%%'
+                ))::bigint
+            FROM {self.TABLE} c
+            JOIN pg_database d ON d.datname = c.template
+            WHERE c.prefix = %s
+        """,
+            (self.SPARE_HASH_SIZE, self.prefix),
+        )
+        return sorted(self.cr.fetchall(), key=EVICTION_POLICIES[policy])
 
     @property
     def size(self):
-        with self._lock():
-            pattern = self._make_pattern()
-            self.cr.execute(
-                """
-                SELECT count(*) FROM pg_database
-                WHERE datname like %s
-            """,
-                (pattern,),
-            )
-            return self.cr.fetchone()[0]
+        self.cr.execute(
+            f"""
+            SELECT count(*) FROM {self.TABLE} c
+            JOIN pg_database d ON d.datname = c.template
+            WHERE c.prefix = %s
+        """,
+            (self.prefix,),
+        )
+        return self.cr.fetchone()[0]
 
     def purge(self):
-        with self._lock():
-            pattern = self._make_pattern()
-            self.cr.execute(
-                """
-                SELECT datname FROM pg_database
-                WHERE datname like %s
-            """,
-                (pattern,),
-            )
-            for (datname,) in self.cr.fetchall():
-                self._drop_db(datname)
+        self.cr.execute(
+            f"SELECT template, hashsum FROM {self.TABLE} WHERE prefix = %s",
+            (self.prefix,),
+        )
+        for template_name, hashsum in self.cr.fetchall():
+            self._evict(template_name, hashsum, blocking=True)
+        self._drop_spares()
 
-    def trim_size(self, max_size):
+    def trim_size(self, max_size, policy="lru"):
+        """ Keep the max_size templates ranking best under policy, a negative
+        max_size disables trimming """
         count = 0
-        with self._lock():
-            pattern = self._make_pattern()
-            self.cr.execute(
-                """
-                SELECT datname FROM pg_database
-                WHERE datname like %s
-                ORDER BY datname DESC
-                OFFSET %s
-            """,
-                (pattern, max_size),
-            )
-            for (datname,) in self.cr.fetchall():
-                self._drop_db(datname)
+        if max_size < 0:
+            return count
+        rows = self._ranked(policy)
+        for template_name, hashsum, *_ in rows[: max(len(rows) - max_size, 0)]:
+            count += self._evict(template_name, hashsum)
+        return count
+
+    def trim_bytes(self, max_bytes, policy="lru"):
+        """ Evict templates ranking worst under policy until the templates and
+        their spares fit into max_bytes of disk """
+        count = 0
+        rows = self._ranked(policy)
+        total = sum(row[5] for row in rows)
+        for template_name, hashsum, *_, size in rows:
+            if total <= max_bytes:
+                break
+            if self._evict(template_name, hashsum):
+                total -= size
                 count += 1
         return count
 
     def trim_age(self, max_age):
-        count = 0
+        """ Evict templates unused for longer than max_age, a negative max_age
+        disables trimming """
+        if max_age < timedelta(0):
+            return 0
         max_trim = max_age + timedelta(minutes=1)
-        with self._lock():
-            pattern = self._make_pattern()
-            max_name = self._make_pattern(
-                dt=datetime.utcnow() - max_trim, hs=self.MAX_HASHSUM
-            )
-            self.cr.execute(
-                """
-                SELECT datname FROM pg_database
-                WHERE datname like %s
-                  AND datname <= %s
-                ORDER BY datname DESC
-            """,
-                (pattern, max_name),
-            )
-            for (datname,) in self.cr.fetchall():
-                self._drop_db(datname)
-                count += 1
+        self.cr.execute(
+            f"""
+            SELECT template, hashsum FROM {self.TABLE}
+            WHERE prefix = %s
+              AND last_used <= %s
+            ORDER BY last_used DESC
+        """,
+            (self.prefix, datetime.utcnow() - max_trim),
+        )
+        count = 0
+        for template_name, hashsum in self.cr.fetchall():
+            count += self._evict(template_name, hashsum)
         return count
+
+
+def refill(dsn, prefix, spares, hashsum):
+    try:
+        with DbCache(dsn, prefix, spares) as dbcache:
+            count = dbcache.refill(hashsum)
+            _log.debug(f"{count} spare database(s) refilled for {hashsum}")
+    except psycopg2.Error as e:
+        _log.warning(f"Refilling spare databases for {hashsum} failed: {e}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+    _prefix, _spares, _hashsum = sys.argv[1:]
+    refill(os.environ["DODOO_INIT_CACHE_DSN"], _prefix, int(_spares), _hashsum)
@@ -6,7 +6,9 @@
 """This module implements the cli subcommand for dodoo init"""
 
 import click
+import dodoo
 from dodoo_init import __version__, init as _init, trim_cache as _trim_cache
+from dodoo_init.cache import EVICTION_POLICIES
 
 from dodoo.cli import CONTEXT_SETTINGS, EPILOG
 
@@ -25,12 +27,34 @@ CACHE_PREFIX_REGEX = r"^[A-Za-z][A-Za-z0-9-]{0,7}$"
 )
 @click.option("--with-demo", is_flag=True, help="Load Odoo demo data.")
 @click.option("--no-cache", is_flag=True, help="Don't use cache.")
-@click.argument("database")
+@click.option(
+    "--spares",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Keep N spare clones of a hit cache template ready for the next init.",
+)
+@click.option(
+    "--count",
+    type=click.IntRange(min=1),
+    help="Create N databases, named after DATABASE as a template with a "
+    "'{n}' placeholder.",
+)
+@click.argument("databases", metavar="DATABASE...", nargs=-1, required=True)
 @click.version_option(version=__version__)
-def init(*args, **kwargs):
-    _init(*args, **kwargs)
+def init(*args, count, databases, **kwargs):
+    if count:
+        if len(databases) != 1 or "{n}" not in databases[0]:
+            raise click.UsageError(
+                "--count requires a single DATABASE with a '{n}' placeholder."
+            )
+        databases = [databases[0].replace("{n}", str(n)) for n in range(1, count + 1)]
+    if len(set(databases)) != len(databases):
+        raise click.UsageError("DATABASE names must be unique.")
+    _init(*args, databases=list(databases), **kwargs)
 
 
+@dodoo.stages(dodoo.STAGE.Config)
 @click.command(
     context_settings=CONTEXT_SETTINGS, help=_trim_cache.__doc__, epilog=EPILOG
 )
@@ -46,9 +70,22 @@ def init(*args, **kwargs):
     default=5,
     show_default=True,
     type=int,
-    help="Keep N most recently used cache templates. Use "
+    help="Keep N cache templates, ranked by the eviction policy. Use "
     "-1 to disable. Use 0 to empty.",
 )
+@click.option(
+    "--max-bytes",
+    type=click.IntRange(min=0),
+    help="Evict cache templates, ranked by the eviction policy, until they "
+    "and their spares fit into N bytes of disk.",
+)
+@click.option(
+    "--policy",
+    default="lru",
+    show_default=True,
+    type=click.Choice(sorted(EVICTION_POLICIES)),
+    help="Eviction policy to rank cache templates.",
+)
 def trim_init_cache(*args, **kwargs):
     _trim_cache(*args, **kwargs)
 
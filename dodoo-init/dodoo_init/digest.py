@@ -0,0 +1,113 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the dodoo init addons content digest"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+_log = logging.getLogger(__name__)
+
+
+EXCLUDE_PATTERNS = ("*.pyc", "*.pyo")
+# Files modified that recently might still change within the same mtime tick
+RACY_WINDOW_NS = 2 * 10 ** 9
+CHUNK_SIZE = 1024 * 1024
+
+
+def _walk(top: Path, exclude_patterns: Tuple[str] = EXCLUDE_PATTERNS) -> Iterator[Path]:
+    """Visit all files excluding specified patterns."""
+    for root, dirnames, filenames in os.walk(top):
+        root = Path(root)
+        reltop = root.relative_to(top)
+        dirnames.sort()
+        for fname in sorted(filenames):
+            fpath = reltop / fname
+            if not any(fpath.match(pattern) for pattern in exclude_patterns):
+                yield fpath
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileDigestCache:
+    """Manage a persistent cache of per-file content digests.
+
+    Entries are grouped by module path and keyed by the file path relative
+    to it. An entry is reused as long as the file's inode, size and mtime_ns
+    are unchanged, otherwise the file is hashed again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file: Path):
+        self.file = file
+        self.entries = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, list]]:
+        try:
+            data = json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        return data.get("modules", {})
+
+    def save(self) -> None:
+        data = {"version": self.VERSION, "modules": self.entries}
+        tmp = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data))
+            # Atomic: concurrent inits never read a partially written cache
+            os.replace(str(tmp), str(self.file))
+        except OSError:
+            _log.warning(f"Could not persist digest cache to '{self.file}'.")
+
+    def _module_digest(self, module_path: Path, trusted_before_ns: int):
+        known = self.entries.get(str(module_path), {})
+        fresh = {}
+        h = hashlib.sha1()
+        for fpath in _walk(module_path):
+            abspath = module_path / fpath
+            st = abspath.stat()
+            key = str(fpath)
+            signature = [st.st_ino, st.st_size, st.st_mtime_ns]
+            entry = known.get(key)
+            if entry and entry[:3] == signature:
+                digest = entry[3]
+            else:
+                digest = _file_digest(abspath)
+            if st.st_mtime_ns < trusted_before_ns:
+                fresh[key] = signature + [digest]
+            h.update(key.encode())
+            h.update(digest.encode())
+        return h.hexdigest(), fresh
+
+    def digests(self, module_paths: List[Path], max_workers: int = None) -> List[str]:
+        """Return the content digest of each module path, in order.
+
+        Modules are hashed concurrently; cache entries of hashed modules are
+        replaced so that files removed in the meantime are dropped."""
+        trusted_before_ns = time.time_ns() - RACY_WINDOW_NS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                executor.map(
+                    lambda p: self._module_digest(p, trusted_before_ns), module_paths
+                )
+            )
+        for module_path, (_digest, fresh) in zip(module_paths, results):
+            self.entries[str(module_path)] = fresh
+        return [digest for digest, _fresh in results]
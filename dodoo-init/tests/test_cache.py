@@ -1,5 +1,12 @@
+import os
+import subprocess
+import sys
 from datetime import datetime, timedelta
 
+import psycopg2
+import pytest
+
+import dodoo
 import dodoo_init.cache as cache
 
 TEST_HASH_A = "a" * cache.DbCache.HASH_SIZE
@@ -48,6 +55,8 @@ def test_dbcache_trim_size(db, dbcache):
     assert dbcache.size == 2
     dbcache.add(db, TEST_HASH_C)
     assert dbcache.size == 3
+    dbcache.trim_size(max_size=-1)  # disabled
+    assert dbcache.size == 3
     dbcache.trim_size(max_size=2)
     assert dbcache.size == 2
     dbcache.purge()
@@ -68,6 +77,8 @@ def test_dbcache_trim_age(db, dbcache, mocker):
     dbcache.add(db, TEST_HASH_C)
     assert dbcache.size == 3
     dt.utcnow.return_value = now
+    dbcache.trim_age(timedelta(days=-1))  # disabled
+    assert dbcache.size == 3
     dbcache.trim_age(timedelta(days=5))
     assert dbcache.size == 3
     dbcache.trim_age(timedelta(days=4))  # "older than 4"
@@ -76,3 +87,117 @@ def test_dbcache_trim_age(db, dbcache, mocker):
     assert dbcache.size == 2
     dbcache.purge()
     assert dbcache.size == 0
+
+
+def test_dbcache_spares(db, newdb, newdb2, dbcache):
+    dbcache.spares = 2
+    assert dbcache.refill(TEST_HASH_A) == 0  # Nothing to clone from
+    dbcache.add(db, TEST_HASH_A)
+    assert dbcache.refill(TEST_HASH_A) == 2
+    assert dbcache.refill(TEST_HASH_A) == 0
+    spares = dbcache._find_spares(TEST_HASH_A)
+    assert len(spares) == 2
+    assert dbcache.create(newdb, TEST_HASH_A)
+    assert spares[0] not in dbcache._find_spares(TEST_HASH_A)
+    dbcache.wait()
+    assert len(dbcache._find_spares(TEST_HASH_A)) == 2
+    assert dbcache.size == 1
+    dbcache.purge()
+    assert dbcache.size == 0
+    assert dbcache._find_spares() == []
+
+
+def test_dbcache_metadata(db, newdb, dbcache):
+    dbcache.add(db, TEST_HASH_A)
+    assert dbcache.create(newdb, TEST_HASH_A)
+    dbcache.cr.execute(
+        f"SELECT template, hits, size FROM {dbcache.TABLE} WHERE prefix = %s",
+        (dbcache.prefix,),
+    )
+    template, hits, size = dbcache.cr.fetchone()
+    assert template == dbcache._make_template_name(TEST_HASH_A)
+    assert hits == 1
+    assert size > 0
+    dbcache.purge()
+    assert dbcache.size == 0
+
+
+def test_dbcache_locks_per_hashsum(db, dbcache):
+    with dbcache._lock(TEST_HASH_A):
+        with cache.DbCache(dbcache.dsn, dbcache.prefix) as other:
+            with other._try_lock(TEST_HASH_B) as locked:
+                assert locked
+            with other._try_lock(TEST_HASH_A) as locked:
+                assert not locked
+
+
+def test_dbcache_trim_bytes(db, dbcache):
+    dbcache.add(db, TEST_HASH_A, build_time=10)
+    dbcache.add(db, TEST_HASH_B, build_time=1)
+    assert dbcache.size == 2
+    assert dbcache.trim_bytes(max_bytes=2 ** 40) == 0
+    assert dbcache.size == 2
+    one_template = dbcache._ranked("cost")[0][5]
+    # B is cheapest to rebuild, so it goes first
+    assert dbcache._ranked("cost")[0][1] == TEST_HASH_B
+    assert dbcache.trim_bytes(max_bytes=one_template, policy="cost") == 1
+    assert dbcache._find_template(TEST_HASH_A)
+    assert dbcache.trim_bytes(max_bytes=0) == 1
+    assert dbcache.size == 0
+
+
+def test_dbcache_trim_size_lfu(db, newdb, dbcache):
+    dbcache.add(db, TEST_HASH_A)
+    assert dbcache.create(newdb, TEST_HASH_A)
+    dbcache.add(db, TEST_HASH_B)
+    # B is most recently used, but A has more hits
+    dbcache.trim_size(max_size=1, policy="lfu")
+    assert dbcache._find_template(TEST_HASH_A)
+    assert not dbcache._find_template(TEST_HASH_B)
+    dbcache.purge()
+    assert dbcache.size == 0
+
+
+def test_dbcache_create_many(db, newdb, newdb2, dbcache):
+    assert not dbcache.create_many([newdb, newdb2], TEST_HASH_A)
+    dbcache.add(db, TEST_HASH_A)
+    assert dbcache.create_many([newdb, newdb2], TEST_HASH_A)
+    assert dodoo.utils.db.db_exists(newdb)
+    assert dodoo.utils.db.db_exists(newdb2)
+    assert dbcache._ranked("lfu")[0][3] == 2
+    dbcache.purge()
+    assert dbcache.size == 0
+
+
+def test_dbcache_create_many_failed(db, newdb, newdb2, dbcache):
+    dbcache.add(db, TEST_HASH_A)
+    assert dbcache.create(newdb2, TEST_HASH_A)
+    dbcache.spares = 1
+    assert dbcache.refill(TEST_HASH_A) == 1
+    # The spare is renamed to newdb before cloning newdb2 fails
+    with pytest.raises(psycopg2.errors.DuplicateDatabase):
+        dbcache.create_many([newdb, newdb2], TEST_HASH_A)
+    assert not dodoo.utils.db.db_exists(newdb)
+    assert dodoo.utils.db.db_exists(newdb2)
+    dbcache.spares = 0
+    dbcache.purge()
+    assert dbcache.size == 0
+
+
+def test_refill_reports_failures():
+    env = dict(os.environ, DODOO_INIT_CACHE_DSN="host=/nonexistent dbname=none")
+    args = [sys.executable, "-m", cache.__name__, "cachetest", "1", TEST_HASH_A]
+    result = subprocess.run(args, env=env, stderr=subprocess.PIPE)
+    # Not swallowed by the detached process
+    assert b"Refilling spare databases" in result.stderr
+
+
+def test_dbcache_legacy_templates(db, dbcache):
+    legacy = f"cachetest-201901010000-{TEST_HASH_A}"
+    dbcache._create_db_from_template(legacy, db)
+    dbcache._track_legacy_templates()
+    assert dbcache._find_template(TEST_HASH_A) == legacy
+    assert dbcache._ranked("lru")[0][2] == datetime(2019, 1, 1)
+    dbcache.purge()
+    assert dbcache.size == 0
+    assert not dodoo.utils.db.db_exists(legacy)
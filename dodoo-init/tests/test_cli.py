@@ -3,7 +3,13 @@ from dodoo_init.cli import init, trim_init_cache
 
 INIT_ARGS_A = "-i base -i mail --with-demo mydatabase"
 INIT_ARGS_B = "-i base -i mail --no-cache mydatabase"
+INIT_ARGS_C = "-i base --spares 2 mydatabase"
+INIT_ARGS_D = "-i base mydatabase otherdatabase"
+INIT_ARGS_E = "-i base --count 3 mydatabase-{n}"
+INIT_FAULTY_ARGS_F = "-i base --count 3 mydatabase"
+INIT_FAULTY_ARGS_G = "-i base mydatabase mydatabase"
 TRIM_ARGS = "--max-age 5 --max-size 3"
+TRIM_ARGS_B = "--max-bytes 1073741824 --policy cost"
 
 
 def test_init_help():
@@ -19,12 +25,28 @@ def test_trim_init_cache_help():
 
 
 def test_init(mocker):
-    mocker.patch("dodoo_init.cli._init")
+    _init = mocker.patch("dodoo_init.cli._init")
     runner = CliRunner()
     result = runner.invoke(init, INIT_ARGS_A.split())
     assert result.exit_code == 0
     result = runner.invoke(init, INIT_ARGS_B.split())
     assert result.exit_code == 0
+    result = runner.invoke(init, INIT_ARGS_C.split())
+    assert result.exit_code == 0
+    result = runner.invoke(init, INIT_ARGS_D.split())
+    assert result.exit_code == 0
+    assert _init.call_args[1]["databases"] == ["mydatabase", "otherdatabase"]
+    result = runner.invoke(init, INIT_ARGS_E.split())
+    assert result.exit_code == 0
+    assert _init.call_args[1]["databases"] == [
+        "mydatabase-1",
+        "mydatabase-2",
+        "mydatabase-3",
+    ]
+    result = runner.invoke(init, INIT_FAULTY_ARGS_F.split())
+    assert result.exit_code != 0
+    result = runner.invoke(init, INIT_FAULTY_ARGS_G.split())
+    assert result.exit_code != 0
 
 
 def test_trim_init_cache(mocker):
@@ -32,3 +54,7 @@ def test_trim_init_cache(mocker):
     runner = CliRunner()
     result = runner.invoke(trim_init_cache, TRIM_ARGS.split())
     assert result.exit_code == 0
+    result = runner.invoke(trim_init_cache, TRIM_ARGS_B.split())
+    assert result.exit_code == 0
+    result = runner.invoke(trim_init_cache, ["--policy", "nonexistent"])
+    assert result.exit_code != 0
@@ -0,0 +1,70 @@
+import os
+
+import dodoo_init.digest as digest
+
+
+def _module(path, files):
+    path.mkdir()
+    for name, content in files.items():
+        (path / name).write_text(content)
+    return path
+
+
+def _age(path, seconds=10):
+    # Mark files as settled, outside of the racy window
+    for child in path.iterdir():
+        st = child.stat()
+        os.utime(child, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10 ** 9))
+
+
+def test_walk_excludes(tmp_path):
+    mod = _module(tmp_path / "mod", {"a.py": "a", "a.pyc": "b", "b.pyo": "c"})
+    assert [str(p) for p in digest._walk(mod)] == ["a.py"]
+
+
+def test_digests_cold_equals_warm(tmp_path):
+    mod_a = _module(tmp_path / "mod_a", {"__init__.py": "", "a.py": "a"})
+    mod_b = _module(tmp_path / "mod_b", {"__init__.py": "", "b.py": "b"})
+    _age(mod_a)
+    _age(mod_b)
+    cache_file = tmp_path / "cache" / "digest-cache.json"
+    cold = digest.FileDigestCache(cache_file)
+    cold_digests = cold.digests([mod_a, mod_b])
+    cold.save()
+    assert cache_file.exists()
+    warm = digest.FileDigestCache(cache_file)
+    assert str(mod_a) in warm.entries
+    assert warm.digests([mod_a, mod_b]) == cold_digests
+    assert digest.FileDigestCache(tmp_path / "other").digests([mod_b, mod_a]) == list(
+        reversed(cold_digests)
+    )
+
+
+def test_digests_detect_changes(tmp_path, mocker):
+    mod = _module(tmp_path / "mod", {"a.py": "a", "b.py": "b"})
+    _age(mod)
+    cache_file = tmp_path / "digest-cache.json"
+    cache = digest.FileDigestCache(cache_file)
+    (before,) = cache.digests([mod])
+    cache.save()
+
+    spy = mocker.spy(digest, "_file_digest")
+    cache = digest.FileDigestCache(cache_file)
+    assert cache.digests([mod]) == [before]
+    assert spy.call_count == 0
+
+    (mod / "a.py").write_text("changed")
+    assert cache.digests([mod]) != [before]
+    assert spy.call_count == 1
+    # Recently modified files are not trusted ...
+    assert "a.py" not in cache.entries[str(mod)]
+    (mod / "b.py").unlink()
+    cache.digests([mod])
+    # ... and removed files are dropped
+    assert "b.py" not in cache.entries[str(mod)]
+
+
+def test_corrupted_cache_is_ignored(tmp_path):
+    cache_file = tmp_path / "digest-cache.json"
+    cache_file.write_text("{not json")
+    assert digest.FileDigestCache(cache_file).entries == {}
@@ -1,6 +1,14 @@
 import logging
 
-from dodoo_init import __version__, addons_digest, init, trim_cache
+import pytest
+from dodoo_init import (
+    DIGEST_CACHE_FILE,
+    ClonesNotCreatedError,
+    __version__,
+    addons_digest,
+    init,
+    trim_cache,
+)
 
 
 def test_version():
@@ -18,16 +26,24 @@ def test_addons_digest(main_loaded, caplog):
     assert "iap" in caplog.text
     assert "web" in caplog.text
 
+    from dodoo.interfaces import odoo
+
+    digest_cache_file = odoo.Config().data_dir() / DIGEST_CACHE_FILE
+    assert digest_cache_file.exists()
+    # A cold run yields the same digest as a warm run
+    digest_cache_file.unlink()
+    assert addons_digest(["base", "mail"], True) == hash_without_demo
+
 
 def test_odoo_createdb_init_and_cache(db, newdb, newdb2, main_loaded, caplog):
     caplog.set_level(logging.INFO)
-    init(modules=["base"], with_demo=True, no_cache=False, database=newdb)
+    init(modules=["base"], with_demo=True, no_cache=False, databases=[newdb])
     assert "loading base" in caplog.text
     assert f"New database '{newdb}' created." in caplog.text
     assert f"Demo data in '{newdb}' loaded." in caplog.text
     assert f"Database '{newdb}' put in db cache." in caplog.text
     caplog.clear()
-    init(modules=["base"], with_demo=True, no_cache=False, database=newdb2)
+    init(modules=["base"], with_demo=True, no_cache=False, databases=[newdb2])
     assert "loading base" not in caplog.text
     assert f"New database '{newdb2}' created." not in caplog.text
     assert f"Demo data in '{newdb2}' loaded." not in caplog.text
@@ -44,3 +60,25 @@ def test_odoo_createdb_init_and_cache(db, newdb, newdb2, main_loaded, caplog):
     assert f"No database cleared from cache (max-age)." in caplog.text
     # ... yet, max_size codepath should NOT have executed (max_size = None).
     assert f"(max-size)." not in caplog.text
+
+
+@pytest.mark.parametrize("cloned", [True, False])
+def test_init_cache_miss_clones(mocker, cloned):
+    mocker.patch("dodoo_init.addons_digest", return_value="digest")
+    mocker.patch("dodoo_init.dbutils")
+    mocker.patch("dodoo_init.AttachmentStoragePatcher")
+    mocker.patch("dodoo_init.odoo_createdb")
+    odoo = mocker.patch("dodoo_init.odoo")
+    DbCache = mocker.patch("dodoo_init.DbCache")
+    dbcache = DbCache.return_value.__enter__.return_value
+    dbcache.create_many.side_effect = [False, cloned]
+    databases = ["db1", "db2", "db3"]
+    if not cloned:
+        with pytest.raises(ClonesNotCreatedError):
+            init(["base"], False, False, databases)
+        odoo.Modules.return_value.reflect.assert_not_called()
+        return
+    init(["base"], False, False, databases)
+    dbcache.create_many.assert_called_with(["db2", "db3"], "digest")
+    reflect = odoo.Modules.return_value.reflect
+    assert [c[0][0] for c in reflect.call_args_list] == ["db2", "db3"]
@@ -4,9 +4,11 @@
 # =============================================================================
 """This module implements the common data accessors shared among servers"""
 
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
 from starlette.datastructures import Secret
 
 import dodoo
+from dodoo.pools import POOLS
 
 SessionDataKey = "session_data"
 
@@ -28,3 +30,35 @@ class SessionSecret(Secret):
 SessionMiddlewareArgs = dict(
     secret_key=SessionSecret(), session_cookie=SessionDataKey, https_only=True
 )
+
+
+class PoolCollector:
+    """Exports the per-database connection pool saturation and wait times."""
+
+    def collect(self):
+        stats = POOLS.stats
+        gauges = [
+            ("maxconn", "Maximum number of connections"),
+            ("used", "Number of borrowed connections"),
+            ("idle", "Number of idle connections"),
+            ("saturation", "Ratio of borrowed to maximum connections"),
+        ]
+        counters = [
+            ("borrowed", "Connections borrowed"),
+            ("waited", "Borrowers queued for a connection"),
+            ("wait_seconds", "Time borrowers queued for a connection"),
+            ("exhausted", "Borrowers timed out queuing for a connection"),
+        ]
+        for key, doc in gauges:
+            family = GaugeMetricFamily(f"dodoo_pool_{key}", doc, labels=["dbname"])
+            for dbname, s in stats.items():
+                family.add_metric([dbname], s[key])
+            yield family
+        for key, doc in counters:
+            family = CounterMetricFamily(f"dodoo_pool_{key}", doc, labels=["dbname"])
+            for dbname, s in stats.items():
+                family.add_metric([dbname], s[key])
+            yield family
+
+
+REGISTRY.register(PoolCollector())
@@ -14,7 +14,7 @@ def init_odoo(db, newdb, main_loaded):
     modules = ["base"]
     with_demo = True
     no_cache = False
-    init(modules, with_demo, no_cache, newdb)
+    init(modules, with_demo, no_cache, [newdb])
     yield newdb
 
 
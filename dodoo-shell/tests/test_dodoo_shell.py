@@ -24,7 +24,7 @@ def db(db, newdb, main_loaded):
     modules = ["base"]
     with_demo = True
     no_cache = False
-    init(modules, with_demo, no_cache, newdb)
+    init(modules, with_demo, no_cache, [newdb])
     yield newdb
 
 
@@ -6,16 +6,18 @@
 
 
 __version__ = "0.0.1"
-__all__ = ["RUNMODE", "main", "framework"]
+__all__ = ["RUNMODE", "STAGE", "main", "framework", "config", "stages", "subscribe"]
 
 import logging
 import logging.config
 import enum
 import sys
-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 from dodoo.logger import DEFAULT_LOGGING_CONFIG
 
 _log = logging.getLogger(__name__)
@@ -29,19 +31,201 @@ class RUNMODE(enum.Enum):
     Production = 3
 
 
+class STAGE(enum.Enum):
+    """Bootstrap stages a subcommand may need"""
+
+    Config = 1  # load configs, open the module catalog
+    Framework = 2  # import and configure odoo
+    Patches = 3  # patch odoo, initialize its addons paths
+    Schema = 4  # provision the database schema layout
+
+
+def stages(*needed: STAGE):
+    """Declare the bootstrap stages a (click) subcommand needs. Undeclared
+    subcommands get all of them. Stages it doesn't declare are deferred:
+    accessing the framework still runs them, on first use."""
+
+    def decorator(cmd):
+        cmd.dodoo_stages = frozenset(needed)
+        return cmd
+
+    return decorator
+
+
 # Those might import RUNMODE
+from .catalog import CATALOG, CATALOG_FILE  # noqa
 from .configs import load_config  # noqa
+from .configs.watcher import ConfdWatcher  # noqa
 from .interfaces import odoo  # noqa
 from .patchers.odoo import Patcher  # noqa
-from .connections import create_custom_schema_layout  # noqa
+from .connections import (  # noqa
+    SCHEMA_LAYOUT_FILE,
+    SCHEMA_LAYOUT_WORKERS,
+    SchemaLayoutMarkers,
+    create_custom_schema_layout,
+)
 
 _framework = None
+_config = None
+_bootstrap = None
+_subscribers = []
 
 
 def framework():
+    if _framework is None and _bootstrap:
+        # Deferred, run on first use
+        _bootstrap.run(STAGE.Patches)
     return _framework
 
 
+def config():
+    """Return the current config snapshot."""
+    if _config is None and _bootstrap:
+        _bootstrap.run(STAGE.Config)
+    return _config
+
+
+def subscribe(callback) -> None:
+    """Subscribe callback(old, new) to config snapshot swaps."""
+    _subscribers.append(callback)
+
+
+def reload_config() -> bool:
+    """Swap in a fresh config snapshot, if any config changed, and notify the
+    subscribers. Called back by the config dir watcher."""
+    global _config
+    old = _config
+    new = old.reload()
+    if new is old:
+        return False
+    # Readers either see the old or the new snapshot, never a mix of both
+    _config = new
+    if _framework:
+        _framework.dodoo_config = new
+    for callback in _subscribers:
+        try:
+            callback(old, new)
+        except Exception:
+            _log.error(f"Config subscriber {callback} failed.", exc_info=True)
+    return True
+
+
+class Bootstrap:
+    """Run bootstrap stages, together with the stages they require, once and
+    record how long each one took."""
+
+    REQUIRES = {
+        STAGE.Config: (),
+        STAGE.Framework: (STAGE.Config,),
+        STAGE.Patches: (STAGE.Framework,),
+        STAGE.Schema: (STAGE.Config,),
+    }
+
+    def __init__(
+        self,
+        framework_dir: Path,
+        config_dir: Path,
+        call_home: bool,
+        run_mode: RUNMODE,
+        projectversion_file: Path,
+    ):
+        self.framework_dir = framework_dir
+        self.config_dir = config_dir
+        self.call_home = call_home
+        self.run_mode = run_mode
+        self.projectversion_file = projectversion_file
+        self.timings = {}  # stage: seconds
+        self._lock = threading.RLock()
+
+    def run(self, stage: STAGE) -> None:
+        with self._lock:
+            if stage in self.timings:
+                return
+            for required in self.REQUIRES[stage]:
+                self.run(required)
+            start = time.monotonic()
+            getattr(self, f"_run_{stage.name.lower()}")()
+            self.timings[stage] = time.monotonic() - start
+        msg = f"Bootstrap stage {stage.name} took {self.timings[stage]:.3f}s."
+        _log.debug(msg)
+
+    def __str__(self):
+        total = sum(self.timings.values())
+        stages = ", ".join(
+            f"{stage.name.lower()} {seconds:.3f}s"
+            for stage, seconds in self.timings.items()
+        )
+        return f"{total:.3f}s ({stages or 'no stages'})"
+
+    def _run_config(self):
+        global _config
+        _config = load_config(self.config_dir, self.run_mode)
+        CATALOG.open(_config.Odoo.data_dir / CATALOG_FILE)
+        # Config changes are picked up in the background, not on the hot path
+        ConfdWatcher(self.config_dir, reload_config).start()
+
+    def _run_framework(self):
+        global _framework
+        # Load odoo module from specified framework path
+        if self.framework_dir:
+            sys.path.insert(0, str(self.framework_dir))
+
+        # Hold a reference to the global odoo namespace so it's not
+        # garbage collected after beeing patched
+        import odoo as _framework
+
+        _framework.dodoo_run_mode = self.run_mode
+        _framework.dodoo_project_version = self.projectversion_file.read_text().rstrip()
+        _framework.dodoo_config = _config
+
+        odoo.Tools().resetlocale()
+
+        # Apply configs
+        odoo.Config().defaults()
+        _config.Odoo.apply()
+        # config.Db.apply() - completely patched for hotreload
+        # config.Smtp.apply() - completely patched for hotreload
+
+    def _run_patches(self):
+        if self.call_home:
+            Patcher.features.update(call_home=True)
+        patcher = Patcher(_config.Odoo, _config.Db, _config.Smtp)
+        patcher.apply()
+        subscribe(patcher.swap_config)
+        odoo.Modules().initialize_sys_path()
+
+    def _run_schema(self):
+        # Create database schema layouts on all configured database (if not exists)
+        Db = _config.Db
+        schemata = [Db.odoo_schema, Db.dodoo_schema]
+        dsns = set(Db.per_dbname_dsn.values()) | {Db.default_dsn}
+        markers = SchemaLayoutMarkers(_config.Odoo.data_dir / SCHEMA_LAYOUT_FILE)
+        markers.retain(dsns, schemata)
+        pending = sorted(dsn for dsn in dsns if not markers.created(dsn, schemata))
+        errors = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=SCHEMA_LAYOUT_WORKERS) as executor:
+                futures = [
+                    (dsn, executor.submit(create_custom_schema_layout, dsn, schemata))
+                    for dsn in pending
+                ]
+            for dsn, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    markers.mark(dsn, schemata)
+            msg = (
+                f"Schema layout created on {len(pending) - len(errors)} of "
+                f"{len(pending)} new dsn(s), {len(dsns) - len(pending)} skipped."
+            )
+            _log.info(msg)
+        markers.save()
+        if errors:
+            raise errors[0]
+
+
 def main(
     framework_dir: Path,
     config_dir: Path,
@@ -50,6 +234,7 @@ def main(
     verbosity: Optional[int],
     log_config: Optional[Path],
     projectversion_file: Path,
+    stages: Iterable[STAGE] = tuple(STAGE),
 ) -> None:
     """Provide the common cli entrypoint, initialize the dodoo python
     environment, load configuration and set up logging.
@@ -65,36 +250,11 @@ def main(
         logging.config.dictConfig(DEFAULT_LOGGING_CONFIG)
     logging.captureWarnings(True)
 
-    config = load_config(config_dir, run_mode)
-
-    # Load odoo module from specified framework path
-    if framework_dir:
-        sys.path.insert(0, str(framework_dir))
-
-    # Hold a reference to the global odoo namespace so it's not
-    # garbage collected after beeing patched
-    global _framework
-    import odoo as _framework
-
-    _framework.dodoo_run_mode = run_mode
-    _framework.dodoo_project_version = projectversion_file.read_text().rstrip()
-    _framework.dodoo_config = config
-
-    odoo.Tools().resetlocale()
-
-    if call_home:
-        Patcher.features.update(call_home=True)
-    Patcher(config.Odoo, config.Db, config.Smtp).apply()
-
-    # Apply configs
-    odoo.Config().defaults()
-    config.Odoo.apply()
-    # config.Db.apply() - completely patched for hotreload
-    # config.Smtp.apply() - completely patched for hotreload
-    odoo.Modules().initialize_sys_path()
-
-    # Create database schema layouts on all configured database (if not exists)
-    for dsn in list(config.Db.per_dbname_dsn.values()) + [config.Db.default_dsn]:
-        create_custom_schema_layout(
-            dsn, [config.Db.odoo_schema, config.Db.dodoo_schema]
-        )
+    global _bootstrap
+    _bootstrap = Bootstrap(
+        framework_dir, config_dir, call_home, run_mode, projectversion_file
+    )
+    for stage in sorted(stages, key=lambda s: s.value):
+        _bootstrap.run(stage)
+    msg = f"Bootstrapped in {_bootstrap}."
+    _log.info(msg)
@@ -0,0 +1,400 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the persistent module catalog"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from dodoo.interfaces import odoo
+
+_log = logging.getLogger(__name__)
+
+
+CATALOG_FILE = "dodoo/module-catalog.json"
+
+
+class ModuleNotFound(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Module:
+    name: str
+    path: str
+    manifest: str
+    manifest_mtime: int  # ns, as of the scan
+    dbuuid: Optional[str] = None
+
+    @property
+    def addons_path(self) -> Path:
+        return Path(self.path).parent
+
+
+class ModuleCatalog:
+    """Manage a persistent index of the modules found in directory trees.
+
+    A tree is either an addons dir (addons paths are searched recursively),
+    a scoped addons dir (first level sub-directories are dbuuids, each one
+    an addons dir) or a single addons path. Every visited directory's
+    mtime_ns is recorded: as adding, removing or renaming a module (or its
+    manifest) changes its parent's mtime, a tree is only scanned again if one
+    of them changed.
+
+    Trees are validated once after loading or a `refresh()`, later lookups
+    are answered from memory.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file: Path = None):
+        self._lock = threading.RLock()
+        self.file = None
+        self._trees = {}
+        self._validated = set()
+        self._paths = {}  # addons path: modules, of validated trees
+        # Bumped whenever lookups may answer differently
+        self.generation = 0
+        self._refreshed = time.monotonic()
+        if file:
+            self.open(file)
+
+    def open(self, file: Path) -> None:
+        """Load the persisted index from file, and persist to it from now on."""
+        with self._lock:
+            self.file = file
+            self._trees = self._load()
+            self._validated = set()
+            self._paths = {}
+            self.generation += 1
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            data = json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        trees = data.get("trees", {})
+        for tree in trees.values():
+            tree["modules"] = [Module(*m) for m in tree["modules"]]
+        return trees
+
+    def save(self) -> None:
+        if not self.file:
+            return
+        trees = {
+            key: {
+                "dirs": tree["dirs"],
+                "modules": [
+                    [m.name, m.path, m.manifest, m.manifest_mtime, m.dbuuid]
+                    for m in tree["modules"]
+                ],
+            }
+            for key, tree in self._trees.items()
+        }
+        data = {"version": self.VERSION, "trees": trees}
+        tmp = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data))
+            # Atomic: concurrent processes never read a partially written index
+            os.replace(str(tmp), str(self.file))
+        except OSError:
+            _log.warning(f"Could not persist module catalog to '{self.file}'.")
+
+    def refresh(self, max_age: float = None) -> None:
+        """Have all trees validated against the file system on next lookup,
+        unless they have been within max_age seconds."""
+        with self._lock:
+            if max_age and time.monotonic() - self._refreshed < max_age:
+                return
+            self._refreshed = time.monotonic()
+            self._validated = set()
+            self._paths = {}
+            self.generation += 1
+
+    # Scanning
+
+    def _manifest(
+        self, path: str, manifest_names
+    ) -> Tuple[Optional[str], Optional[os.stat_result]]:
+        for name in manifest_names:
+            try:
+                return name, os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+        return None, None
+
+    def _scan_addons_dir(
+        self, top: str, dbuuid: Optional[str], dirs, modules, recursive=True
+    ):
+        manifest_names = odoo.Modules().MANIFEST_NAMES
+        stack = [top]
+        while stack:
+            current = stack.pop()
+            try:
+                dirs[current] = os.stat(current).st_mtime_ns
+                entries = sorted(os.scandir(current), key=lambda e: e.name)
+            except OSError:
+                continue
+            found, subdirs = [], []
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                # Also if not descended into: adding a manifest (or a python
+                # package's __init__.py) only changes this one's mtime
+                try:
+                    dirs[entry.path] = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                manifest, st = self._manifest(entry.path, manifest_names)
+                if manifest:
+                    found.append(
+                        Module(entry.name, entry.path, manifest, st.st_mtime_ns, dbuuid)
+                    )
+                elif not os.path.exists(os.path.join(entry.path, "__init__.py")):
+                    # Python packages don't contain modules
+                    subdirs.append(entry.path)
+            if found:
+                # An addons path, its module-less sub-directories aren't searched
+                modules.extend(found)
+            elif recursive:
+                stack.extend(reversed(subdirs))
+
+    def _scan(self, kind: str, top: str) -> dict:
+        dirs, modules = {}, []
+        if kind == "scoped":
+            try:
+                dirs[top] = os.stat(top).st_mtime_ns
+                entries = sorted(os.scandir(top), key=lambda e: e.name)
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.is_dir():
+                    self._scan_addons_dir(entry.path, entry.name, dirs, modules)
+        elif kind == "path":
+            self._scan_addons_dir(top, None, dirs, modules, recursive=False)
+        else:
+            self._scan_addons_dir(top, None, dirs, modules)
+        return {"dirs": dirs, "modules": modules}
+
+    def _valid(self, tree: dict) -> bool:
+        for path, mtime in tree["dirs"].items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _tree(self, kind: str, top: os.PathLike) -> List[Module]:
+        key = f"{kind}:{top}"
+        with self._lock:
+            if key in self._validated:
+                return self._trees[key]["modules"]
+            tree = self._trees.get(key)
+            if not tree or not self._valid(tree):
+                msg = f"Scanning {top} for modules."
+                _log.debug(msg)
+                tree = self._trees[key] = self._scan(kind, str(top))
+                self.save()
+            self._validated.add(key)
+            self._paths = {}
+            for validated in self._validated:
+                for m in self._trees[validated]["modules"]:
+                    self._paths.setdefault(m.addons_path, []).append(m)
+            return tree["modules"]
+
+    # Lookups
+
+    def addons_paths(self, addons_dir: os.PathLike) -> List[Path]:
+        """Return all addons paths within an addons dir."""
+        modules = self._tree("addons", addons_dir)
+        return sorted({m.addons_path for m in modules})
+
+    def scoped_addons_paths(self, scoped_addons_dir: os.PathLike) -> Dict[str, list]:
+        """Return the addons paths within a scoped addons dir by dbuuid."""
+        paths = {}
+        for m in self._tree("scoped", scoped_addons_dir):
+            paths.setdefault(m.dbuuid, set()).add(m.addons_path)
+        return {dbuuid: sorted(p) for dbuuid, p in paths.items()}
+
+    def modules(self, addons_path: os.PathLike) -> List[Module]:
+        """Return the modules of an addons path, which may be part of any
+        tree already known."""
+        addons_path = Path(addons_path)
+        with self._lock:
+            for key in list(self._trees):
+                kind, top = key.split(":", 1)
+                if kind != "path" and key not in self._validated:
+                    self._tree(kind, top)
+            if addons_path in self._paths:
+                return self._paths[addons_path]
+            return self._tree("path", addons_path)
+
+    def resolve(self, addons_paths: Iterable[os.PathLike]) -> Dict[str, Module]:
+        """Map module names to modules, the first addons path wins (like odoo)."""
+        found = {}
+        for addons_path in addons_paths:
+            for m in self.modules(addons_path):
+                found.setdefault(m.name, m)
+        return found
+
+
+CATALOG = ModuleCatalog()
+
+
+class ScopedModules:
+    """Resolve the names of the modules available to a database: those of the
+    unscoped addons paths, plus those scoped to its dbuuid. Resolved once per
+    dbuuid, until the catalog is refreshed."""
+
+    def __init__(self, catalog: ModuleCatalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._generation = None
+
+    def resolve(
+        self,
+        dbuuid: Optional[str],
+        addons_paths: Iterable[os.PathLike],
+        scoped_addons_paths: Dict[str, List[Path]],
+    ) -> FrozenSet[str]:
+        addons_paths = tuple(str(p) for p in addons_paths)
+        key = (dbuuid, addons_paths)
+        with self._lock:
+            if self._generation != self.catalog.generation:
+                self._cache = {}
+                self._generation = self.catalog.generation
+            names = self._cache.get(key)
+        if names is None:
+            scoped = {str(p) for paths in scoped_addons_paths.values() for p in paths}
+            paths = [p for p in addons_paths if p not in scoped]
+            if dbuuid:
+                paths += scoped_addons_paths.get(dbuuid, [])
+            names = frozenset(self.catalog.resolve(paths))
+            with self._lock:
+                if self._generation == self.catalog.generation:
+                    self._cache[key] = names
+        return names
+
+
+SCOPED_MODULES = ScopedModules(CATALOG)
+
+
+class ManifestCache:
+    """Cache parsed manifests until their file is modified."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # manifest file: (mtime_ns, manifest)
+
+    def get(self, module: Module) -> dict:
+        path = os.path.join(module.path, module.manifest)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        manifest = odoo.Modules().parse_manifest_from(module.name)
+        with self._lock:
+            self._entries[path] = (mtime, manifest)
+        return manifest
+
+
+MANIFESTS = ManifestCache()
+
+
+class ModuleGraph:
+    """The dependency graph of modules, with forward and reverse dependency
+    indexes and an index of the auto_install modules each module triggers.
+    Closures are computed in linear time of the modules and dependencies
+    visited."""
+
+    def __init__(self, modules: Dict[str, Module], manifests: Dict[str, dict]):
+        self.modules = modules
+        self.manifests = manifests
+        self.depends = {}
+        self.dependents = {}
+        self.auto_install = set()
+        self.triggers = {}
+        for name, manifest in manifests.items():
+            depends = tuple(dict.fromkeys(manifest.get("depends", ["base"])))
+            self.depends[name] = depends
+            for dep in depends:
+                self.dependents.setdefault(dep, set()).add(name)
+            if manifest.get("auto_install"):
+                self.auto_install.add(name)
+                for dep in depends:
+                    self.triggers.setdefault(dep, []).append(name)
+
+    def closure(self, modules: Iterable[str], include_auto_install=True) -> Set[str]:
+        """Return the modules with all their transitive dependencies and, by
+        default, the auto_install modules whose dependencies are all in."""
+        res = set()
+        queue = deque(modules)
+        missing = {}
+        if include_auto_install:
+            missing = {name: len(self.depends[name]) for name in self.auto_install}
+            queue.extend(name for name, count in missing.items() if not count)
+        while queue:
+            module = queue.popleft()
+            if module in res:
+                continue
+            if module not in self.depends:
+                raise ModuleNotFound(module)
+            res.add(module)
+            queue.extend(self.depends[module])
+            for auto in self.triggers.get(module, ()) if include_auto_install else ():
+                missing[auto] -= 1
+                if not missing[auto]:
+                    queue.append(auto)
+        return res
+
+    def dependents_closure(self, modules: Iterable[str]) -> Set[str]:
+        """Return the modules with all modules transitively depending on them,
+        eg. all modules affected by a change."""
+        res = set()
+        queue = deque(modules)
+        while queue:
+            module = queue.popleft()
+            if module in res:
+                continue
+            res.add(module)
+            queue.extend(self.dependents.get(module, ()))
+        return res
+
+
+_graph = (None, None)
+
+
+def module_graph() -> ModuleGraph:
+    """Return the graph of all modules on odoo's addons paths. It's built
+    from cached manifests, and only rebuilt when the catalog is refreshed or
+    the addons paths change."""
+    global _graph
+    odoo.Modules().initialize_sys_path()
+    addons_paths = tuple(str(p) for p in odoo.Patchable.ad_paths)
+    key = (CATALOG.generation, addons_paths)
+    if _graph[0] != key:
+        modules = CATALOG.resolve(addons_paths)
+        manifests = {}
+        for name, module in modules.items():
+            manifest = MANIFESTS.get(module)
+            if manifest:
+                manifests[name] = manifest
+        _graph = (key, ModuleGraph(modules, manifests))
+    return _graph[1]
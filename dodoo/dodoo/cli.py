@@ -11,7 +11,7 @@ import click_pathlib
 from click_plugins import with_plugins
 from pkg_resources import iter_entry_points
 
-from dodoo import RUNMODE, __version__, main as _main
+from dodoo import RUNMODE, STAGE, __version__, main as _main
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix="DODOO")
 EPILOG = (
@@ -96,8 +96,12 @@ EPILOG = (
     # help="Specify the version file containing the project's semantic version",
 )
 @click.version_option(version=__version__)
-def main(*args, **kwargs):
-    _main(*args, **kwargs)
+@click.pass_context
+def main(ctx, *args, **kwargs):
+    # Run only the bootstrap stages the subcommand declares (default: all)
+    cmd = ctx.command.get_command(ctx, ctx.invoked_subcommand)
+    stages = getattr(cmd, "dodoo_stages", tuple(STAGE))
+    _main(*args, stages=stages, **kwargs)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -5,12 +5,14 @@
 """This package implements the dodoo.configs api for Odoo server configuration"""
 
 __version__ = "0.0.1"
-__all__ = ["load_config", "BaseConfig", "read_secret", "PathLike"]
+__all__ = ["load_config", "Config", "BaseConfig", "read_secret", "PathLike"]
 
 import json
 import logging
 import os
 import stat
+import time
+from dataclasses import dataclass
 from pathlib import Path
 
 from mashumaro import DataClassDictMixin
@@ -42,8 +44,12 @@ DEFAULT_SMTPPASSWORD_FILE: str = "/run/secrets/smtppassword"
 # ==============
 
 
-def read_secret(env_var: str) -> str:
-    path = Path(os.environ.get(env_var, globals().get("DEFAULT_" + env_var)))
+# Cached secrets by path: (file stamp, validated at, secret)
+_secrets = {}
+SECRET_REVALIDATE_INTERVAL = 5  # seconds
+
+
+def _read_secret(path: Path) -> str:
     # Check when accessed to enforce restrictive config api
     if not path.is_absolute():
         raise PathNotAbsoluteError(path)
@@ -59,6 +65,31 @@ def read_secret(env_var: str) -> str:
     return path.read_text().rstrip()
 
 
+def read_secret(env_var: str) -> str:
+    """Read a secret, which is cached until its file is replaced or modified.
+    Within SECRET_REVALIDATE_INTERVAL, the cached secret is returned without
+    any file access; after that, a stat tells if it's still current."""
+    path = Path(os.environ.get(env_var, globals().get("DEFAULT_" + env_var)))
+    now = time.monotonic()
+    cached = _secrets.get(path)
+    if cached and now - cached[1] < SECRET_REVALIDATE_INTERVAL:
+        return cached[2]
+    try:
+        st = os.stat(str(path))
+        # ctime, as a chmod must be revalidated, too
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+    except OSError:
+        stamp = None
+    if cached and stamp == cached[0]:
+        _secrets[path] = (stamp, now, cached[2])
+        return cached[2]
+    _secrets.pop(path, None)
+    secret = _read_secret(path)
+    if stamp:
+        _secrets[path] = (stamp, now, secret)
+    return secret
+
+
 # ==============
 # Config Impl.
 # ==============
@@ -91,26 +122,26 @@ def load_config(config_dir, run_mode):
     from .smtp import SmtpConfigDevelop, SmtpConfigStage, SmtpConfigProd
     from .odoo import OdooConfigDevelop, OdooConfigStage, OdooConfigProd
 
-    class Config:
-        Odoo = None
-        Smtp = None
-        Db = None
-
     if run_mode == RUNMODE.Develop:
-        Config.Odoo = OdooConfigDevelop.load(config_dir)
-        Config.Db = DbConfigDevelop.load(config_dir)
-        Config.Smtp = SmtpConfigDevelop.load(config_dir)
+        return Config(
+            Odoo=OdooConfigDevelop.load(config_dir),
+            Db=DbConfigDevelop.load(config_dir),
+            Smtp=SmtpConfigDevelop.load(config_dir),
+        )
     elif run_mode == RUNMODE.Staging:
-        Config.Odoo = OdooConfigStage.load(config_dir)
-        Config.Db = DbConfigStage.load(config_dir)
-        Config.Smtp = SmtpConfigStage.load(config_dir)
+        return Config(
+            Odoo=OdooConfigStage.load(config_dir),
+            Db=DbConfigStage.load(config_dir),
+            Smtp=SmtpConfigStage.load(config_dir),
+        )
     elif run_mode == RUNMODE.Production:
-        Config.Odoo = OdooConfigProd.load(config_dir)
-        Config.Db = DbConfigProd.load(config_dir)
-        Config.Smtp = SmtpConfigProd.load(config_dir)
+        return Config(
+            Odoo=OdooConfigProd.load(config_dir),
+            Db=DbConfigProd.load(config_dir),
+            Smtp=SmtpConfigProd.load(config_dir),
+        )
     else:
         raise Exception()  # Never hit
-    return Config
 
 
 class PathLike(os.PathLike, SerializableType):
@@ -154,17 +185,34 @@ class BaseConfig(DataClassDictMixin):
         self._validate()
 
     def reload(self):
+        """Return a freshly loaded config, or self if unchanged or invalid.
+        Configs are immutable: swap the returned one in."""
+        name = type(self).__name__
         try:
             newconfig = self.__class__.load(self.confd)
-            if self != newconfig:
-                _log.info(f"Updated {self.__name__}.")
-                self = newconfig
-                return True
-            else:
-                return False
         except Exception:
-            _log.warning(f"Hot reload of {self.__name__} failed.")
-            return False
+            _log.warning(f"Hot reload of {name} failed.", exc_info=True)
+            return self
+        if newconfig == self:
+            return self
+        _log.info(f"Updated {name}.")
+        return newconfig
 
     def _validate(self):
         return
+
+
+@dataclass(frozen=True)
+class Config:
+    """An immutable snapshot of all configs, swapped as a whole on reload."""
+
+    Odoo: BaseConfig
+    Db: BaseConfig
+    Smtp: BaseConfig
+
+    def reload(self) -> "Config":
+        """Return a fresh snapshot, or self if no config changed."""
+        new = Config(
+            Odoo=self.Odoo.reload(), Db=self.Db.reload(), Smtp=self.Smtp.reload()
+        )
+        return self if new == self else new
@@ -61,7 +61,7 @@ class DbConfig(BaseConfig):
         if cfg.get("default_dsn"):
             cfg["default_dsn"] = _ensure_dsn_with_passfile(cfg.get("default_dsn"))
         if cfg.get("per_dbname_dsn"):
-            for dbname, dsn in cfg.get("per_dbname_dsn"):
+            for dbname, dsn in cfg.get("per_dbname_dsn").items():
                 cfg["per_dbname_dsn"][dbname] = _ensure_dsn_with_passfile(dsn)
 
     def _validate(self):
@@ -73,7 +73,7 @@ class DbConfig(BaseConfig):
                 raise NoSecretsInConfigError(dsn)
 
         _contains_no_password(self.default_dsn)
-        for _dbname, dsn in self.per_dbname_dsn:
+        for _dbname, dsn in self.per_dbname_dsn.items():
             _contains_no_password(dsn)
 
 
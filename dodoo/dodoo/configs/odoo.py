@@ -12,6 +12,7 @@ from pathlib import Path
 from typing import FrozenSet, List
 
 from dataclasses import InitVar, dataclass, field
+from dodoo.catalog import CATALOG
 from dodoo.interfaces import odoo
 
 from . import BaseConfig, PathLike, read_secret
@@ -26,28 +27,13 @@ pathlib.PosixPath._serialize = PathLike._serialize
 
 def find_addons_path(addons_dir: os.PathLike):
     """Recursively find all addons path within a directory"""
-    paths = set()
-    for root, dirnames, files in os.walk(addons_dir):
-        if Path(root).parent in paths:
-            dirnames.clear()
-            continue
-        if "__init__.py" in files:
-            dirnames.clear()
-        if not any(M in files for M in odoo.Modules().MANIFEST_NAMES):
-            continue
-        paths |= {Path(root).parent}
-    return sorted(list(paths))  # We promise alphabetical order
+    return CATALOG.addons_paths(addons_dir)  # We promise alphabetical order
 
 
 def find_scoped_addons_path(addons_dir: os.PathLike):
     """Find all addons path within a directory, the first level
     sub-directories beeing expected to be DBUUIDs."""
-    paths_map = {}
-    for dbuuid in addons_dir.iterdir():
-        if not dbuuid.is_dir():
-            continue
-        paths_map[dbuuid] = find_addons_path(dbuuid)
-    return paths_map
+    return CATALOG.scoped_addons_paths(addons_dir)
 
 
 @dataclass(frozen=True)
@@ -0,0 +1,63 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements the config dir watcher"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+
+class ConfdWatcher(threading.Thread):
+    """Polls the config dir's entries for changes in the background and calls
+    back once per change, so that nobody on a hot path ever has to.
+
+    Entries are compared by mtime, size and inode: files replaced by an atomic
+    rename (eg. kubernetes config maps) are detected, too."""
+
+    INTERVAL = 2  # seconds
+
+    def __init__(self, confd: os.PathLike, callback, interval: float = None):
+        super().__init__(name="dodoo-confd-watcher", daemon=True)
+        self.confd = Path(confd)
+        self.callback = callback
+        self.interval = interval or self.INTERVAL
+        self._stopped = threading.Event()
+        self._state = self._scan()
+
+    def _scan(self):
+        state = {}
+        try:
+            entries = list(os.scandir(str(self.confd)))
+        except OSError:
+            return state
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            state[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return state
+
+    def check(self) -> bool:
+        """Call back if the config dir changed since the last check."""
+        state = self._scan()
+        if state == self._state:
+            return False
+        self._state = state
+        try:
+            self.callback()
+        except Exception:
+            _log.warning(f"Reloading configs from {self.confd} failed.", exc_info=True)
+        return True
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
@@ -4,27 +4,128 @@
 # =============================================================================
 """This module implements the dodoo database connection api and helpers"""
 
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Set
 
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import parse_dsn
 
 _log = logging.getLogger(__name__)
 
+SCHEMA_LAYOUT_FILE = "dodoo/schema-layouts.json"
+# Connections used to create schema layouts concurrently
+SCHEMA_LAYOUT_WORKERS = 8
+
 
 class SchemaNotCreatedError(Exception):
     pass
 
 
+class ConnectionPool:
+    """A process-wide pool of idle connections, keyed by dsn and schema.
+
+    The search path is set once per connection, through its startup options.
+    Borrowers must leave the session state untouched; autocommit connections
+    are reset (DISCARD ALL, which releases advisory locks, too) on return."""
+
+    MAX_IDLE = 4  # per key
+    IDLE_TIMEOUT = 300  # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Never touch the parent's sockets
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def _connect(self, dsn, schema):
+        if schema:
+            return psycopg2.connect(dsn, options=f"-c search_path={schema}")
+        return psycopg2.connect(dsn)
+
+    def getconn(self, dsn, schema=None, autocommit=False):
+        conn = None
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.get((dsn, schema), [])
+            while idle and not conn:
+                conn, since = idle.pop()
+                if conn.closed or time.monotonic() - since > self.IDLE_TIMEOUT:
+                    conn.close()
+                    conn = None
+            if conn:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not conn:
+            conn = self._connect(dsn, schema)
+        conn.autocommit = autocommit
+        return conn
+
+    def putconn(self, conn, dsn, schema=None):
+        if conn.closed:
+            return
+        try:
+            if conn.autocommit:
+                with conn.cursor() as cr:
+                    cr.execute("DISCARD ALL")
+            else:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+            return
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.setdefault((dsn, schema), [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def discard(self, dbname=None):
+        """Close idle connections (to dbname), e.g. before dropping it."""
+        with self._lock:
+            self._check_fork()
+            for (dsn, schema), idle in list(self._idle.items()):
+                if dbname and parse_dsn(dsn).get("dbname") != dbname:
+                    continue
+                for conn, _since in idle:
+                    conn.close()
+                del self._idle[(dsn, schema)]
+
+    @property
+    def stats(self):
+        with self._lock:
+            idle = sum(len(idle) for idle in self._idle.values())
+        return {"hits": self.hits, "misses": self.misses, "idle": idle}
+
+
+POOL = ConnectionPool()
+
+
 class AutocommitConnection:
-    def __init__(self, dsn):
+    def __init__(self, dsn, schema=None):
         self.dsn = dsn
+        self.schema = schema
 
     def __enter__(self):
-        self.conn = psycopg2.connect(self.dsn)
-        self.conn.autocommit = True
+        self.conn = POOL.getconn(self.dsn, self.schema, autocommit=True)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.close()
+        POOL.putconn(self.conn, self.dsn, self.schema)
 
 
 class SchemaCursor:
@@ -34,22 +135,19 @@ class SchemaCursor:
         self.schema = schema
 
     def __enter__(self):
-        self.conn = psycopg2.connect(self.dsn)
+        self.conn = POOL.getconn(self.dsn, self.schema)
         self.cr = self.conn.cursor()
-        self.cr.execute(f"SET search_path TO {self.schema}")
-
         return self.cr
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.dry:
-            self.conn.rollback()
-        elif isinstance(exc_type, psycopg2.Error):
-            self.conn.rollback()
-            self.conn.close()
-            raise exc_type(exc_val)
-        else:
-            self.conn.commit()
-        self.conn.close()
+        try:
+            if self.dry or exc_type:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        finally:
+            self.cr.close()
+            POOL.putconn(self.conn, self.dsn, self.schema)
 
 
 class DodooCursor(SchemaCursor):
@@ -91,6 +189,91 @@ def create_custom_schema_layout(dsn, schemata):
             raise SchemaNotCreatedError(e)
 
 
+def ensure_schema_layout(conn, schemata) -> bool:
+    """Create the schemata missing on an open connection's database. Returns
+    whether any was missing."""
+    with conn.cursor() as cr:
+        cr.execute(
+            "SELECT nspname FROM pg_namespace WHERE nspname = ANY(%s)", (schemata,)
+        )
+        missing = set(schemata) - {nspname for (nspname,) in cr.fetchall()}
+        for schema in sorted(missing):
+            cr.execute(
+                sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema))
+            )
+    conn.commit()
+    if missing:
+        _log.warning(
+            f"Schemata {', '.join(sorted(missing))} were missing on database "
+            f"{conn.info.dbname}, created them."
+        )
+    return bool(missing)
+
+
+class SchemaLayoutMarkers:
+    """Manage persistent markers of the dsns a schema layout has been created
+    on, so that it's only created on new dsns or for changed schemata.
+
+    A marker is a fingerprint of the dsn and its schemata: dsns, which may
+    carry credentials, are never persisted in the clear. Remove the file to
+    have all layouts created again.
+
+    A database recreated behind a marked dsn misses its schemata: odoo's
+    connection pools check them on their first connection, and create them
+    (see `ensure_schema_layout`)."""
+
+    VERSION = 1
+
+    def __init__(self, file: Path):
+        self.file = file
+        self.fingerprints = self._load()
+        self._changed = False
+
+    def _load(self) -> Set[str]:
+        try:
+            data = json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return set()
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return set()
+        return set(data.get("fingerprints", []))
+
+    def save(self) -> None:
+        if not self._changed:
+            return
+        data = {"version": self.VERSION, "fingerprints": sorted(self.fingerprints)}
+        tmp = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data))
+            # Atomic: concurrently starting processes never read a partial file
+            os.replace(str(tmp), str(self.file))
+        except OSError:
+            _log.warning(f"Could not persist schema layout markers to '{self.file}'.")
+        self._changed = False
+
+    @staticmethod
+    def fingerprint(dsn: str, schemata: Iterable[str]) -> str:
+        h = hashlib.sha1(dsn.encode("utf8"))
+        for schema in schemata:
+            h.update(b"\0" + schema.encode("utf8"))
+        return h.hexdigest()
+
+    def created(self, dsn: str, schemata: Iterable[str]) -> bool:
+        return self.fingerprint(dsn, schemata) in self.fingerprints
+
+    def mark(self, dsn: str, schemata: Iterable[str]) -> None:
+        self.fingerprints.add(self.fingerprint(dsn, schemata))
+        self._changed = True
+
+    def retain(self, dsns: Iterable[str], schemata: Iterable[str]) -> None:
+        """Forget the markers of dsns no longer configured."""
+        fingerprints = {self.fingerprint(dsn, schemata) for dsn in dsns}
+        if not self.fingerprints <= fingerprints:
+            self.fingerprints &= fingerprints
+            self._changed = True
+
+
 def create_readonly_user_for_schema(dsn, schema):
     with PublicCursor(dsn) as cr:
         ro_user = f"{dsn.connections.info.user}-readonly"
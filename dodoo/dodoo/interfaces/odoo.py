@@ -64,6 +64,11 @@ class Registry:
         registry = import_module("odoo.modules.registry")
         return registry.Registry.registries.items()
 
+    @staticmethod
+    def delete(dbname):
+        registry = import_module("odoo.modules.registry")
+        registry.Registry.delete(dbname)
+
 
 class Environment:
     @staticmethod
@@ -174,6 +179,10 @@ class Database:
     def close_all(self):
         self._r.close_all()
 
+    @property
+    def Connection(self):
+        return self._r.Connection
+
 
 class Config:
     def __init__(self):
@@ -195,6 +204,9 @@ class Config:
         fresh_config_obj._parse_config()
         self._configmodule.config = fresh_config_obj
 
+    def data_dir(self):
+        return Path(self.config["data_dir"])
+
     def filestore(self, dbname):
         return Path(self.config.filestore(dbname))
 
@@ -217,6 +229,7 @@ class Patchable:
     # odoo.addons.mail
     # odoo.conf
     # odoo.http
+    # odoo.modules.db
     # odoo.modules.module
     # odoo.service.db
     # odoo.sql_db
@@ -228,6 +241,7 @@ class Patchable:
     install_from_urls = PProp(
         "odoo.addons.base.models.ir_module:Module.install_from_urls"
     )
+    update_list = PProp("odoo.addons.base.models.ir_module:Module.update_list")
 
     # odoo.addons.mail
     update_notification = PProp(
@@ -238,6 +252,9 @@ class Patchable:
     # odoo.http
     db_filter = PProp("odoo.http:db_filter")
 
+    # odoo.modules.db
+    initialize = PProp("odoo.modules.db:initialize")
+
     # odoo.modules.module
     ad_paths = PProp("odoo.modules.module:ad_paths")
     get_modules = PProp("odoo.modules.module:get_modules")
@@ -254,6 +271,8 @@ class Patchable:
     exp_migrate_databases = PProp("odoo.service.db:exp_migrate_databases")
 
     # odoo.sql_db
+    close_all = PProp("odoo.sql_db:close_all")
+    close_db = PProp("odoo.sql_db:close_db")
     connection_info_for = PProp("odoo.sql_db:connection_info_for")
     db_connect = PProp("odoo.sql_db:db_connect")
 
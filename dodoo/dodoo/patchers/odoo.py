@@ -4,19 +4,26 @@
 # =============================================================================
 """This module implements a centralized monkey patcher for Odoo to suck less"""
 
-
+import contextvars
+import functools
 import logging
-import os
 import re
 
 from psycopg2.extensions import make_dsn, parse_dsn
 
 import dodoo
+from dodoo.catalog import CATALOG, SCOPED_MODULES
+from dodoo.connections import ensure_schema_layout
 from dodoo.interfaces import odoo
 from dodoo.patchers import BasePatcher
+from dodoo.pools import POOLS
 
 _log = logging.getLogger(__name__)
 
+# The dbuuid whose modules `get_modules` lists, declared by its callers
+_scope = contextvars.ContextVar("dodoo_modules_scope", default=None)
+UNSCOPED = ""
+
 
 # ==============
 # Custom Errors
@@ -36,6 +43,9 @@ def _db_ops_alternative(alternative, *args, **kwargs):
 
 # Inheriting order important
 class Patcher(odoo.Patchable, BasePatcher):
+    wrapped = ("update_list", "initialize")
+    originals = {}
+
     def __init__(self, odooconfig, dbconfig, smtpconfig):
         """Initializes the patcher"""
         self.OdooConfig = odooconfig
@@ -93,26 +103,51 @@ class Patcher(odoo.Patchable, BasePatcher):
     def verify_admin_password(self, password):
         return password == self.OdooConfig.Sec.admin_passwd
 
+    def swap_config(self, old, new):
+        """Subscribed to config snapshot swaps: only databases which are
+        affected by the change are drained."""
+        self.OdooConfig = new.Odoo
+        self.DbConfig = new.Db
+        self.SmtpConfig = new.Smtp
+        for dbname, pool in POOLS.pools.items():
+            if old.Db.resolve_dsn(dbname) != new.Db.resolve_dsn(dbname):
+                _log.info(f"Connection of {dbname} changed, draining its pool.")
+                pool.drain()
+                # Its registry holds on to the old connection info
+                odoo.Registry.delete(dbname)
+            pool.resize(new.Db.resolve_maxconn(dbname))
+
     def connection_info_for(self, dbname):
-        # Already reloaded by _patch_odoo_db_connect
-        # reloaded = self.DbConfig.reload()
         dsn = self.DbConfig.resolve_dsn(dbname)
-        return dbname, parse_dsn(make_dsn(dsn, dbname=dbname, application_name="odoo"))
+        params = parse_dsn(make_dsn(dsn, dbname=dbname, application_name="odoo"))
+        # Set once per (pooled) connection, at no extra round trip
+        search_path = f"-c search_path={self.DbConfig.odoo_schema}"
+        params["options"] = f"{params.get('options', '')} {search_path}".strip()
+        return dbname, params
+
+    def db_connect(self, dbname, allow_uri=False):
+        db, info = self.connection_info_for(dbname)
+        if not allow_uri and db != dbname:
+            raise ValueError("URI connections not allowed")
+        # One pool per database, so that a busy one can't starve the others
+        pool = POOLS.get(
+            db, self.DbConfig.resolve_maxconn(db), self._ensure_schema_layout
+        )
+        return odoo.Database().Connection(pool, db, info)
 
-    orig_db_connect = odoo.Patchable().db_connect
+    def _ensure_schema_layout(self, cnx):
+        # Once per pool: the database might be recreated behind a marked dsn
+        ensure_schema_layout(
+            cnx, [self.DbConfig.odoo_schema, self.DbConfig.dodoo_schema]
+        )
 
-    def db_connect(self, dbname):
-        reloaded = self.DbConfig.reload()
-        if reloaded:  # We should recreate all connections
-            odoo.Database().close_all()
-        Connection = Patcher.orig_db_connect(dbname)
-        # Todo: find a way to enable per-database connections
-        # Connection._maxconn = self.DbConfig.resolve_maxconn(dbname)
+    @staticmethod
+    def close_db(dbname):
+        POOLS.close(dbname)
 
-        # As connections are pooled, the performance penalty is negligible
-        with Connection.cursor() as cr:
-            cr.execute(f"SET search_path TO odoo")
-        return Connection
+    @staticmethod
+    def close_all():
+        POOLS.close_all()
 
     @staticmethod
     @BasePatcher.unlessFeature("call_home")
@@ -141,14 +176,13 @@ class Patcher(odoo.Patchable, BasePatcher):
         class CustomList(list):
             pass
 
-        # Store them for significant reference used by patched `get_modules`
-        # to unwrap and reason about the patched scope it should return
+        # For reference, patched `get_modules` resolves the scope on its own
         CustomList.db_scoped = db_scoped
         return CustomList([])
 
     @staticmethod
     def get_modules_with_version(*args, **kargs):
-        """ Not used anywhere in standard odoo code, but conveys possible and
+        """Not used anywhere in standard odoo code, but conveys possible and
         inacceptable side effects on `get_modules` patch."""
         raise NotImplementedError(
             "Fail hard and early. Your code is not compatible with dodoo. "
@@ -158,96 +192,63 @@ class Patcher(odoo.Patchable, BasePatcher):
             "`odoo.modules.module.get_modules()`"
         )
 
-    @staticmethod
-    def get_modules():
+    def apply(self):
+        # Wrapped, not replaced: keep hold of the originals (only once)
+        for attr in self.wrapped:
+            original = getattr(odoo.Patchable(), attr)
+            if original.__module__ != __name__:
+                self.originals[attr] = original
+                # Eg. odoo's api decorator markers
+                functools.update_wrapper(
+                    getattr(self, attr), original, assigned=(), updated=("__dict__",)
+                )
+        super().apply()
+
+    @staticmethod
+    def update_list(records):
+        """Declares the database's scope to `get_modules`: update_list fills
+        the module table, a module that is not listed can't be installed."""
+        # Pick up added or removed modules
+        CATALOG.refresh(max_age=10)
+        params = records.env["ir.config_parameter"].sudo()
+        token = _scope.set(params.get_param("database.uuid"))
+        try:
+            return Patcher.originals["update_list"](records)
+        finally:
+            _scope.reset(token)
+
+    @staticmethod
+    def initialize(cr):
+        """Declares an unscoped database to `get_modules`.
+
+        When first initializing a database, there is no dbuuid yet, so no
+        scoped modules are listed. We use the dbuuid in order to not to produce
+        side effects for later db / host renaming operations done at higher
+        levels of infrastructure management. This is not a problem, as
+        `update_list` is called in sufficient occasions eventually satisfying
+        an updated database representation of the available modules."""
+        token = _scope.set(UNSCOPED)
+        try:
+            return Patcher.originals["initialize"](cr)
+        finally:
+            _scope.reset(token)
+
+    def get_modules(self):
         """Returns the list of module names eventually including
         database scoped modules
         """
-
-        # ###################################################
-        # Inspect caller for method-name based case branching
-        # ###################################################
-        import inspect
-
-        frame = inspect.currentframe().f_back
-
-        if frame.f_code.co_name == "update_list":
-            # We are to update a database's module table
-            # This is the magic: if not listed, the instance will not
-            # be able to install a module.
-            cr = frame.f_locals.get("self").env.cr
-            cr.execute(
-                """
-                SELECT value FROM ir_config_parameter
-                WHERE key='database.uuid'
-            """
-            )
-            return_db_scoped_paths = False
-            (dbuuid,) = cr.fetchone()
-
-        elif frame.f_code.co_name == "initialize":
-            # We are first time initializing a database,
-            # still, there is no dbuuid, so don't load any
-            # custom modules
-            # Note: we use dbuuid in order to not to produce side effects
-            # for later db / host renaming operations done at higher levels
-            # of infrastructure management in the case dbnames are filtered
-            # by hostname. Therefore we need to forgo custom modules
-            # at this stage, this is not a problem, as `update_list` is
-            # called in sufficient occasions eventually satisfying an
-            # updated database representation of the available modules.
-            return_db_scoped_paths = False
-            dbuuid = None
-
-        else:
-            # Just beahve as if all configured paths where be regarded.
-            # It is ensured by construction, that add_paths also includes
-            # the custom module paths.
-            # On v12, this is called in one of:
-            # odoo/addons/test_lint/tests/test_ecmascript.py: a test case
-            #   for js code linting
-            # odoo/addons/test_lint/tests/test_pylint.py: a test case for
-            #   py code linting
-            # odoo/cli/command.py: a hook for extending the odoo command -
-            #   irrelevant in a dodoo context
-            # odoo/service/server.py: used for logging server config
-            #   parameters - we do it our way in dodoo
-            return_db_scoped_paths = True
-            dbuuid = None
-        # ###########
-        # End inspect
-        # ###########
-
-        if dbuuid:
-            ad_paths = list(
-                set(odoo.Patchable.ad_paths)
-                - set(odoo.Patchable.ad_paths.db_scoped.values())
-                | set(odoo.Patchable.ad_paths.db_scoped.get(dbuuid, []))
-            )
-        elif not return_db_scoped_paths:
-            ad_paths = list(
-                set(odoo.Patchable.ad_paths)
-                - set(odoo.Patchable.ad_paths.db_scoped.values())
-            )
-        else:
-            ad_paths = odoo.Patchable.ad_paths
-
-        def listdir(dir):
-            def clean(name):
-                name = os.path.basename(name)
-                if name[-4:] == ".zip":
-                    name = name[:-4]
-                return name
-
-            def is_really_module(name):
-                for mname in odoo.Modules().MANIFEST_NAMES:
-                    if os.path.isfile(os.path.join(dir, name, mname)):
-                        return True
-
-            return [clean(it) for it in os.listdir(dir) if is_really_module(it)]
-
-        plist = []
         odoo.Modules().initialize_sys_path()
-        for ad in ad_paths:
-            plist.extend(listdir(ad))
-        return list(set(plist))
+        ad_paths = odoo.Patchable.ad_paths
+        dbuuid = _scope.get()
+        if dbuuid is None:
+            # Just behave as if all configured paths where be regarded.
+            # It is ensured by construction, that ad_paths also includes
+            # the scoped module paths. On v12, this is only called by the
+            # test_lint tests, odoo's command hook and for logging server
+            # config parameters.
+            return list(CATALOG.resolve(ad_paths))
+        # Resolved once per database, answered by the module catalog
+        scoped = SCOPED_MODULES.resolve(
+            dbuuid or None, ad_paths, self.OdooConfig.resolve_scoped_addons_dir()
+        )
+        return list(scoped)
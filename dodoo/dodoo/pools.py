@@ -0,0 +1,239 @@
+# =============================================================================
+# Created By : David Arnold
+# Part of    : xoe-labs/dodoo
+# =============================================================================
+"""This module implements per-database connection pools for odoo"""
+
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+_log = logging.getLogger(__name__)
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolExhaustedError(PoolError):
+    pass
+
+
+class DatabasePool:
+    """The connection pool of a single database, standing in for odoo's global
+    `sql_db.ConnectionPool` as seen by its Connection and Cursor objects.
+
+    Instead of failing right away when all of its maxconn connections are in
+    use, borrowers queue for up to WAIT_TIMEOUT seconds. Connections idle for
+    longer than IDLE_TIMEOUT seconds are closed.
+
+    Odoo's registries hold on to their pool, hence it's resized and drained in
+    place, never replaced.
+
+    prepare, eventually, is called with the first connection of the pool
+    (again after draining it), eg. to check the database's set up."""
+
+    WAIT_TIMEOUT = 30  # seconds
+    IDLE_TIMEOUT = 300  # seconds
+
+    def __init__(self, dbname, maxconn, prepare=None):
+        self.dbname = dbname
+        self.maxconn = max(int(maxconn), 1)
+        self.prepare = prepare
+        self._prepared = False
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, since), most recently used last
+        self._used = {}  # connection: generation
+        self._generation = 0
+        # Metrics
+        self.borrowed = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.exhausted = 0
+
+    def __repr__(self):
+        return f"<DatabasePool {self.dbname} {len(self._used)}/{self.maxconn}>"
+
+    def _connect(self, connection_info):
+        cnx = psycopg2.connect(**connection_info)
+        cnx._original_dsn = connection_info
+        if self.prepare and not self._prepared:
+            try:
+                self.prepare(cnx)
+            except Exception:
+                cnx.close()
+                raise
+            self._prepared = True
+        return cnx
+
+    def _reap(self, now):
+        while self._idle and now - self._idle[0][1] > self.IDLE_TIMEOUT:
+            cnx, _since = self._idle.pop(0)
+            cnx.close()
+
+    def _pop_idle(self, connection_info):
+        for i, (cnx, _since) in reversed(list(enumerate(self._idle))):
+            if cnx._original_dsn != connection_info:
+                continue
+            del self._idle[i]
+            try:
+                cnx.reset()
+            except psycopg2.OperationalError:
+                cnx.close()
+                continue
+            return cnx
+
+    def reap(self):
+        with self._cond:
+            self._reap(time.monotonic())
+
+    def borrow(self, connection_info):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            self._reap(start)
+            while True:
+                cnx = self._pop_idle(connection_info)
+                if cnx or len(self._used) + len(self._idle) < self.maxconn:
+                    break
+                if self._idle:
+                    # Make room, idle connections belong to another dsn
+                    self._idle.pop(0)[0].close()
+                    continue
+                remaining = start + self.WAIT_TIMEOUT - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise PoolExhaustedError(
+                        f"Timed out after {self.WAIT_TIMEOUT}s waiting for one of "
+                        f"{self.maxconn} connections to {self.dbname}."
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            if not cnx:
+                cnx = self._connect(connection_info)
+            self._used[cnx] = self._generation
+            self.borrowed += 1
+            if waited:
+                wait = time.monotonic() - start
+                self.waited += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        if waited:
+            msg = f"Waited {wait:.3f}s for a connection to {self.dbname}."
+            _log.debug(msg)
+        return cnx
+
+    def give_back(self, connection, keep_in_pool=True):
+        with self._cond:
+            generation = self._used.pop(connection, None)
+            if (
+                keep_in_pool
+                and generation == self._generation
+                and len(self._used) + len(self._idle) < self.maxconn
+                and not connection.closed
+            ):
+                self._idle.append((connection, time.monotonic()))
+            elif not connection.closed:
+                connection.close()
+            self._cond.notify()
+
+    def close_all(self, dsn=None):
+        with self._cond:
+            for cnx, _since in list(self._idle):
+                if dsn is None or cnx._original_dsn == dsn:
+                    self._idle.remove((cnx, _since))
+                    cnx.close()
+
+    def drain(self):
+        """Close idle connections, borrowed ones are closed when given back."""
+        with self._cond:
+            self._generation += 1
+            self._prepared = False
+        self.close_all()
+
+    def resize(self, maxconn):
+        with self._cond:
+            self.maxconn = max(int(maxconn), 1)
+            self._cond.notify_all()
+
+    @property
+    def stats(self):
+        with self._cond:
+            used = len(self._used)
+            idle = len(self._idle)
+        return {
+            "maxconn": self.maxconn,
+            "used": used,
+            "idle": idle,
+            "saturation": used / self.maxconn,
+            "borrowed": self.borrowed,
+            "waited": self.waited,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+            "exhausted": self.exhausted,
+        }
+
+
+class PoolManager:
+    """Hands out one DatabasePool per database, so that a busy database can't
+    starve the others of connections."""
+
+    REAP_INTERVAL = 60  # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._pid = os.getpid()
+        self._reaped = time.monotonic()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Never touch the parent's sockets
+            self._pools = {}
+            self._pid = os.getpid()
+
+    def get(self, dbname, maxconn, prepare=None):
+        """Return the pool of dbname, resized if maxconn changed."""
+        with self._lock:
+            self._check_fork()
+            pool = self._pools.get(dbname)
+            if pool and pool.maxconn != max(int(maxconn), 1):
+                msg = f"Resizing connection pool of {dbname} to {maxconn}."
+                _log.info(msg)
+                pool.resize(maxconn)
+            if not pool:
+                pool = self._pools[dbname] = DatabasePool(dbname, maxconn, prepare)
+            pools = None
+            if time.monotonic() - self._reaped > self.REAP_INTERVAL:
+                self._reaped = time.monotonic()
+                pools = list(self._pools.values())
+        # Also idle databases, which never borrow, are reaped
+        for other in pools or []:
+            other.reap()
+        return pool
+
+    def close(self, dbname):
+        pool = self.pools.get(dbname)
+        if pool:
+            pool.drain()
+
+    def close_all(self):
+        for pool in self.pools.values():
+            pool.drain()
+
+    @property
+    def pools(self):
+        with self._lock:
+            self._check_fork()
+            return dict(self._pools)
+
+    @property
+    def stats(self):
+        return {dbname: pool.stats for dbname, pool in self.pools.items()}
+
+
+POOLS = PoolManager()
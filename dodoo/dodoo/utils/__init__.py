@@ -26,3 +26,14 @@ def ensure_framework(f):
         return f(*args, **kwds)
 
     return wrapper
+
+
+def ensure_config(f):
+    @wraps(f)
+    def wrapper(*args, **kwds):
+        if not dodoo.config():
+            _log.critical("dodoo must load the configs first.")
+            raise FrameworkNotInitialized()
+        return f(*args, **kwds)
+
+    return wrapper
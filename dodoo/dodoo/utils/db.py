@@ -4,23 +4,28 @@
 # =============================================================================
 """This module implments generic database utils with postgres in mind."""
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Tuple
 
-from psycopg2.extensions import parse_dsn
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
 
 import dodoo
-from dodoo.connections import PublicCursor
+from dodoo.connections import POOL, PublicCursor
 
-from . import ensure_framework
+from . import ensure_config
 
 # from `sh` will be lazily imported as it's no hard dependency of dodoo
 
 MAINTENANCE_DATABASE = "postgres"
+CHUNK_SIZE = 1024 * 1024
 
 
-@ensure_framework
+@ensure_config
 def _dsn_resolver(dbname):
-    return dodoo.framework().dodoo_config.Db.resolve_dsn(dbname)
+    return dodoo.config().Db.resolve_dsn(dbname)
 
 
 def _connection_args_from_dsn(dsn):
@@ -36,6 +41,10 @@ def _connection_args_from_dsn(dsn):
     ]
 
 
+def database_dsn(dbname: str) -> str:
+    return _dsn_resolver(dbname)
+
+
 def maintenance_dsn():
     dsn = _dsn_resolver(MAINTENANCE_DATABASE)
     return dsn
@@ -48,19 +57,47 @@ def _maint_conn_args():
 
 
 def drop_database(dbname: str) -> None:
+    POOL.discard(dbname)
+
     from sh import dropdb
 
     dropdb(*_maint_conn_args(), dbname)
 
 
-def backup_database(dbname: str, file: Path) -> None:
+def default_jobs() -> int:
+    """Number of parallel pg_dump / pg_restore jobs: one per core."""
+    return os.cpu_count() or 1
+
+
+def dump_database(dbname: str, out: BinaryIO) -> None:
+    from sh import pg_dump
+
+    pg_dump(*_maint_conn_args(), "--format=custom", dbname, _out=out)
+
+
+def dump_database_directory(dbname: str, directory: Path, jobs: int = None) -> None:
     from sh import pg_dump
 
+    pg_dump(
+        *_maint_conn_args(),
+        "--format=directory",
+        f"--jobs={jobs or default_jobs()}",
+        f"--file={directory}",
+        dbname,
+    )
+
+
+def backup_database(
+    dbname: str, file: Path, directory: bool = False, jobs: int = None
+) -> None:
+    if directory:
+        dump_database_directory(dbname, file, jobs)
+        return
     with file.open("wb") as file:
-        pg_dump(*_maint_conn_args(), "--format=custom", dbname, _out=file)
+        dump_database(dbname, file)
 
 
-def restore_database(dbname: str, file: Path) -> None:
+def create_database(dbname: str) -> None:
     from sh import createdb
 
     createdb(
@@ -72,10 +109,44 @@ def restore_database(dbname: str, file: Path) -> None:
         dbname,
     )
 
+
+def restore_database(dbname: str, file: Path, jobs: int = None) -> None:
+    create_database(dbname)
+
     from sh import pg_restore
 
-    with file.open("rb") as file:
-        pg_restore(*_maint_conn_args(), f"--dbname={dbname}", _in=file)
+    # Custom (seekable file) and directory formats both restore in parallel
+    pg_restore(
+        *_maint_conn_args(),
+        f"--dbname={dbname}",
+        f"--jobs={jobs or default_jobs()}",
+        str(file),
+    )
+
+
+def _chunks(stream: BinaryIO) -> Iterator[bytes]:
+    # A generator, as `sh` can't poll file objects without a real fileno
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def restore_database_stream(dbname: str, stream: BinaryIO) -> None:
+    """Restore a custom format dump read from a (non-seekable) stream."""
+    create_database(dbname)
+
+    from sh import pg_restore
+
+    pg_restore(*_maint_conn_args(), f"--dbname={dbname}", _in=_chunks(stream))
+
+
+def rename_database(dbname: str, new_dbname: str) -> None:
+    POOL.discard(dbname)
+    dsn = _dsn_resolver(MAINTENANCE_DATABASE)
+    with PublicCursor(dsn) as cr:
+        cr.execute(f'ALTER DATABASE "{dbname}" RENAME TO "{new_dbname}"')
 
 
 def copy_db(source: str, dest: str) -> None:
@@ -84,6 +155,92 @@ def copy_db(source: str, dest: str) -> None:
     createdb(*_maint_conn_args(), f"--template={source}", dest)
 
 
+RELATIONS_QUERY = """
+    SELECT format('%%I.%%I', n.nspname, c.relname), c.relkind,
+        pg_total_relation_size(c.oid)
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'S')
+    AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+    AND n.nspname NOT LIKE 'pg_toast%%'
+"""
+
+
+def _buckets(relations: List[Tuple[str, int]], count: int) -> List[List[str]]:
+    # Greedy longest-processing-time-first: balance the buckets by size
+    buckets = [(0, []) for _ in range(count)]
+    for name, size in sorted(relations, key=lambda r: r[1], reverse=True):
+        total, names = min(buckets, key=lambda b: b[0])
+        buckets.remove((total, names))
+        buckets.append((total + size, names + [name]))
+    return [names for _total, names in buckets if names]
+
+
+def stream_copy_db(
+    source: str, dest: str, jobs: int = None, alongside: Callable[[], None] = None
+) -> None:
+    """Copy a database while it's in use, as opposed to CREATE DATABASE's
+    TEMPLATE, which requires the source to be free of connections.
+
+    pg_dump is piped into pg_restore, without temporary files. All pipes share
+    one exported snapshot, so table data is copied consistently in parallel
+    jobs, bucketed by size; constraints and indexes are created last.
+    alongside, eventually, runs concurrently once the snapshot is taken.
+
+    Like a TEMPLATE copy, a failed copy leaves no partially restored dest
+    behind."""
+    from sh import pg_dump, pg_restore
+
+    args = _maint_conn_args()
+    jobs = jobs or default_jobs()
+    create_database(dest)
+    conn = None
+    try:
+        # Imported by the dumps, hence on the same server they connect to
+        conn = psycopg2.connect(make_dsn(maintenance_dsn(), dbname=source))
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cr:
+            cr.execute("SELECT pg_export_snapshot()")
+            (snapshot,) = cr.fetchone()
+            cr.execute(RELATIONS_QUERY)
+            relations = cr.fetchall()
+
+        def pipe(*dump_args):
+            pg_restore(
+                pg_dump(
+                    *args,
+                    f"--snapshot={snapshot}",
+                    "--format=custom",
+                    *dump_args,
+                    source,
+                    _piped=True,
+                ),
+                *args,
+                f"--dbname={dest}",
+            )
+
+        def data(names):
+            pipe("--section=data", *[f"--table={name}" for name in names])
+
+        tables = [(name, size) for name, kind, size in relations if kind == "r"]
+        sequences = [name for name, kind, _size in relations if kind == "S"]
+        buckets = _buckets(tables, jobs * 4)
+        if sequences:
+            buckets.append(sequences)
+        with ThreadPoolExecutor(max_workers=jobs + 1) as executor:
+            along = executor.submit(alongside) if alongside else None
+            pipe("--section=pre-data")
+            list(executor.map(data, buckets))
+            pipe("--section=post-data")
+            if along:
+                along.result()
+    except BaseException:
+        drop_database(dest)
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
 def db_exists(dbname: str) -> None:
     dsn = _dsn_resolver(MAINTENANCE_DATABASE)
     with PublicCursor(dsn) as cr:
@@ -96,6 +253,7 @@ def db_exists(dbname: str) -> None:
 
 
 def terminate_connections(dbname: str) -> None:
+    POOL.discard(dbname)
     dsn = _dsn_resolver(MAINTENANCE_DATABASE)
     with PublicCursor(dsn) as cr:
         cr.execute(
@@ -1,14 +1,17 @@
+import json
 import logging
 
 import pytest
 
 from dodoo import RUNMODE
-from dodoo.configs import load_config
+from dodoo import configs
+from dodoo.configs import load_config, read_secret
 from dodoo.configs._errors import (
     ConfigDirNoDirError,
     ConfigDirOwnershipError,
     NoConfigDirError,
     NoPathError,
+    SecretOwnershipError,
 )
 from dodoo.interfaces import odoo
 
@@ -60,3 +63,46 @@ class TestConfig:
         config.Odoo.apply()
         odoo.Config().defaults()
         assert len(caplog.records) == 0
+
+    def test_config_reload(self, confd, caplog):
+        caplog.set_level(logging.INFO)
+        config = load_config(confd, RUNMODE.Production)
+        assert config.reload() is config
+        dbconfig = confd / "dbconfig.prod.json"
+        orig = dbconfig.read_text()
+        try:
+            dbconfig.write_text(json.dumps({"default_maxconn": 2}))
+            new = config.reload()
+            assert new.Db.default_maxconn == 2
+            assert config.Db.default_maxconn != 2  # Immutable snapshots
+            assert new.Odoo is config.Odoo
+            assert new.Smtp is config.Smtp
+            # Invalid configs are not picked up
+            dbconfig.write_text("{")
+            assert new.reload() is new
+            assert "Hot reload of DbConfigProd failed." in caplog.text
+        finally:
+            dbconfig.write_text(orig)
+
+    def test_read_secret_cache(self, tmp_path, monkeypatch, mocker):
+        secret = tmp_path / "secret"
+        secret.write_text("one")
+        secret.chmod(0o400)
+        monkeypatch.setenv("SOME_FILE", str(secret))
+        read = mocker.spy(configs, "_read_secret")
+        assert read_secret("SOME_FILE") == "one"
+        assert read_secret("SOME_FILE") == "one"
+        assert read.call_count == 1
+        # Revalidated when stale, but only re-read when modified
+        mocker.patch.object(configs, "SECRET_REVALIDATE_INTERVAL", 0)
+        assert read_secret("SOME_FILE") == "one"
+        assert read.call_count == 1
+        rotated = tmp_path / "rotated"
+        rotated.write_text("two")
+        rotated.chmod(0o400)
+        rotated.rename(secret)
+        assert read_secret("SOME_FILE") == "two"
+        assert read.call_count == 2
+        secret.chmod(0o644)
+        with pytest.raises(SecretOwnershipError):
+            read_secret("SOME_FILE")
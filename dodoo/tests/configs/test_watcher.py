@@ -0,0 +1,33 @@
+import os
+
+from dodoo.configs.watcher import ConfdWatcher
+
+
+def test_watcher_calls_back_on_changes(tmp_path, mocker):
+    config = tmp_path / "dbconfig.prod.json"
+    config.write_text("{}")
+    callback = mocker.Mock()
+    watcher = ConfdWatcher(tmp_path, callback)
+    assert not watcher.check()
+    callback.assert_not_called()
+
+    config.write_text('{"default_maxconn": 2}')
+    os.utime(str(config), ns=(0, 0))
+    assert watcher.check()
+    assert not watcher.check()
+    assert callback.call_count == 1
+
+    # Atomically replaced
+    replacement = tmp_path / "replacement"
+    replacement.write_text('{"default_maxconn": 2}')
+    os.utime(str(replacement), ns=(0, 0))
+    replacement.rename(config)
+    assert watcher.check()
+    assert callback.call_count == 2
+
+
+def test_watcher_survives_failing_callback(tmp_path, caplog):
+    watcher = ConfdWatcher(tmp_path, lambda: 1 / 0)
+    (tmp_path / "odooconfig.prod.json").write_text("{}")
+    assert watcher.check()
+    assert "Reloading configs" in caplog.text
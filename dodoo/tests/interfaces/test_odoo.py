@@ -68,6 +68,7 @@ class TestOdooInterface:
         # Odoo's _parse_config() is not idempotent and only works on a freshly
         # initialized config object
         odoo.Config().defaults()
+        odoo.Config().data_dir()
         odoo.Config().filestore("dbname")
         odoo.Config().session_dir()
 
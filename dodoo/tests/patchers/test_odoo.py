@@ -1,9 +1,11 @@
 import logging
+from dataclasses import replace
 
 from dodoo import RUNMODE
 from dodoo.configs import load_config
 from dodoo.interfaces import odoo as odoo_interface
 from dodoo.patchers.odoo import Patcher
+from dodoo.pools import PoolManager
 
 
 class TestOdooPatcher:
@@ -22,6 +24,14 @@ class TestOdooPatcher:
         assert odoo_interface.Patchable().install_from_urls is func
         assert func.__module__ == patcher_module
 
+        func = odoo.addons.base.models.ir_module.Module.update_list
+        assert odoo_interface.Patchable().update_list is func
+        assert func.__module__ == patcher_module
+
+        func = odoo.modules.db.initialize
+        assert odoo_interface.Patchable().initialize is func
+        assert func.__module__ == patcher_module
+
         func = (
             odoo.addons.mail.models.update.PublisherWarrantyContract.update_notification
         )
@@ -76,6 +86,14 @@ class TestOdooPatcher:
         assert odoo_interface.Patchable().exp_migrate_databases is func
         assert func.__module__ == patcher_module
 
+        func = odoo.sql_db.close_all
+        assert odoo_interface.Patchable().close_all is func
+        assert func.__module__ == patcher_module
+
+        func = odoo.sql_db.close_db
+        assert odoo_interface.Patchable().close_db is func
+        assert func.__module__ == patcher_module
+
         func = odoo.sql_db.connection_info_for
         assert odoo_interface.Patchable().connection_info_for is func
         assert func.__module__ == patcher_module
@@ -103,3 +121,36 @@ class TestOdooPatcher:
         func = odoo.tools.misc.find_pg_tool
         assert odoo_interface.Patchable().find_pg_tool is func
         assert func.__module__ == patcher_module
+
+    def test_connection_info_for(self, confd):
+        config = load_config(confd, RUNMODE.Production)
+        patcher = Patcher(config.Odoo, config.Db, config.Smtp)
+        dbname, info = patcher.connection_info_for("somedb")
+        assert dbname == "somedb"
+        assert info["dbname"] == "somedb"
+        assert info["application_name"] == "odoo"
+        assert info["options"] == "-c search_path=odoo"
+
+    def test_swap_config(self, confd, mocker):
+        pools = mocker.patch("dodoo.patchers.odoo.POOLS", PoolManager())
+        delete = mocker.patch.object(odoo_interface.Registry, "delete")
+        config = load_config(confd, RUNMODE.Production)
+        patcher = Patcher(config.Odoo, config.Db, config.Smtp)
+        kept = pools.get("kept", config.Db.resolve_maxconn("kept"))
+        moved = pools.get("moved", config.Db.resolve_maxconn("moved"))
+        drain_kept = mocker.spy(kept, "drain")
+        drain_moved = mocker.spy(moved, "drain")
+        db = replace(
+            config.Db,
+            per_dbname_dsn={"moved": "host=elsewhere"},
+            per_dbname_maxconn={"kept": "2"},
+            validate=True,
+        )
+        new = replace(config, Db=db)
+        patcher.swap_config(config, new)
+        assert patcher.DbConfig is db
+        assert kept.maxconn == 2
+        # Only the affected database is drained
+        drain_kept.assert_not_called()
+        drain_moved.assert_called_once_with()
+        delete.assert_called_once_with("moved")
@@ -0,0 +1,186 @@
+import os
+
+import pytest
+
+from dodoo.catalog import (
+    ManifestCache,
+    ModuleCatalog,
+    ModuleGraph,
+    ModuleNotFound,
+    ScopedModules,
+)
+
+
+@pytest.fixture(autouse=True)
+def odoo_modules(mocker):
+    modules = mocker.patch("dodoo.catalog.odoo.Modules")
+    modules.return_value.MANIFEST_NAMES = ("__manifest__.py", "__openerp__.py")
+    yield modules.return_value
+
+
+def make_module(addons_path, name, manifest="__manifest__.py"):
+    module = addons_path / name
+    module.mkdir(parents=True)
+    (module / "__init__.py").touch()
+    (module / manifest).write_text("{}")
+    return module
+
+
+def test_catalog_addons_dir(tmp_path):
+    addons_dir = tmp_path / "addons"
+    make_module(addons_dir / "repo1", "mod_a")
+    make_module(addons_dir / "repo1", "mod_b", "__openerp__.py")
+    make_module(addons_dir / "nested" / "repo2", "mod_c")
+    (addons_dir / "repo1" / "not_a_module").mkdir()
+    # Python packages are not searched
+    make_module(addons_dir / "package" / "lib", "mod_d")
+    (addons_dir / "package" / "__init__.py").touch()
+
+    catalog = ModuleCatalog(tmp_path / "catalog.json")
+    assert catalog.addons_paths(addons_dir) == [
+        addons_dir / "nested" / "repo2",
+        addons_dir / "repo1",
+    ]
+    names = [m.name for m in catalog.modules(addons_dir / "repo1")]
+    assert names == ["mod_a", "mod_b"]
+    assert (tmp_path / "catalog.json").exists()
+
+
+def test_catalog_invalidation(tmp_path, mocker):
+    addons_path = tmp_path / "addons" / "repo"
+    make_module(addons_path, "mod_a")
+    catalog = ModuleCatalog(tmp_path / "catalog.json")
+    assert len(catalog.modules(addons_path)) == 1
+
+    # Persisted, and not scanned again while unchanged
+    catalog = ModuleCatalog(tmp_path / "catalog.json")
+    scan = mocker.spy(catalog, "_scan")
+    assert len(catalog.modules(addons_path)) == 1
+    assert scan.call_count == 0
+
+    # Looked up in memory, until refreshed
+    make_module(addons_path, "mod_b")
+    assert len(catalog.modules(addons_path)) == 1
+    catalog.refresh()
+    assert len(catalog.modules(addons_path)) == 2
+    assert scan.call_count == 1
+
+    # A removed manifest changes its module directory's mtime
+    os.remove(str(addons_path / "mod_b" / "__manifest__.py"))
+    catalog.refresh()
+    assert [m.name for m in catalog.modules(addons_path)] == ["mod_a"]
+
+
+@pytest.mark.parametrize("kind", ["addons", "path"])
+def test_catalog_new_manifest(tmp_path, kind):
+    addons_path = tmp_path / "addons" / "repo"
+    make_module(addons_path, "mod_a")
+    (addons_path / "mod_b").mkdir()
+    catalog = ModuleCatalog(tmp_path / "catalog.json")
+    if kind == "addons":
+        catalog.addons_paths(tmp_path / "addons")
+    assert [m.name for m in catalog.modules(addons_path)] == ["mod_a"]
+
+    # Eg. checked out into an existing directory
+    (addons_path / "mod_b" / "__manifest__.py").write_text("{}")
+    catalog.refresh()
+    names = [m.name for m in catalog.modules(addons_path)]
+    assert names == ["mod_a", "mod_b"]
+
+
+def test_catalog_scoped_addons_dir(tmp_path):
+    scoped_addons_dir = tmp_path / "scoped"
+    make_module(scoped_addons_dir / "uuid1" / "repo", "mod_a")
+    make_module(scoped_addons_dir / "uuid2" / "repo", "mod_b")
+    catalog = ModuleCatalog()
+    assert catalog.scoped_addons_paths(scoped_addons_dir) == {
+        "uuid1": [scoped_addons_dir / "uuid1" / "repo"],
+        "uuid2": [scoped_addons_dir / "uuid2" / "repo"],
+    }
+    (module,) = catalog.modules(scoped_addons_dir / "uuid2" / "repo")
+    assert module.dbuuid == "uuid2"
+
+
+def test_scoped_modules(tmp_path, mocker):
+    scoped_addons_dir = tmp_path / "scoped"
+    make_module(scoped_addons_dir / "uuid1" / "repo", "mod_a")
+    make_module(scoped_addons_dir / "uuid2" / "repo", "mod_b")
+    make_module(tmp_path / "repo", "mod_c")
+    catalog = ModuleCatalog()
+    scoped_addons_paths = catalog.scoped_addons_paths(scoped_addons_dir)
+    addons_paths = [tmp_path / "repo"] + [
+        p for paths in scoped_addons_paths.values() for p in paths
+    ]
+    scoped = ScopedModules(catalog)
+    resolve = mocker.spy(catalog, "resolve")
+    assert scoped.resolve("uuid1", addons_paths, scoped_addons_paths) == {
+        "mod_a",
+        "mod_c",
+    }
+    assert scoped.resolve(None, addons_paths, scoped_addons_paths) == {"mod_c"}
+
+    # Resolved once per dbuuid, until the catalog is refreshed
+    scoped.resolve("uuid1", addons_paths, scoped_addons_paths)
+    assert resolve.call_count == 2
+    catalog.refresh()
+    scoped.resolve("uuid1", addons_paths, scoped_addons_paths)
+    assert resolve.call_count == 3
+
+
+def test_manifest_cache(tmp_path, odoo_modules):
+    make_module(tmp_path / "repo", "mod_a")
+    (module,) = ModuleCatalog().modules(tmp_path / "repo")
+    odoo_modules.parse_manifest_from.return_value = {"depends": []}
+    manifests = ManifestCache()
+    assert manifests.get(module) == {"depends": []}
+    assert manifests.get(module) == {"depends": []}
+    assert odoo_modules.parse_manifest_from.call_count == 1
+    manifest = tmp_path / "repo" / "mod_a" / "__manifest__.py"
+    os.utime(str(manifest), ns=(0, 0))
+    manifests.get(module)
+    assert odoo_modules.parse_manifest_from.call_count == 2
+
+
+@pytest.fixture
+def graph():
+    manifests = {
+        "base": {"depends": []},
+        "web": {"auto_install": True},
+        "mail": {"depends": ["base", "web"]},
+        "sale": {"depends": ["mail"]},
+        "sale_mail": {"depends": ["sale", "mail"], "auto_install": True},
+        "chained": {"depends": ["sale_mail"], "auto_install": True},
+        "other": {},
+    }
+    yield ModuleGraph({}, manifests)
+
+
+def test_graph_closure(graph):
+    assert graph.closure(["mail"], include_auto_install=False) == {
+        "mail",
+        "base",
+        "web",
+    }
+    assert graph.closure(["sale"]) == {
+        "sale",
+        "mail",
+        "base",
+        "web",
+        "sale_mail",
+        "chained",
+    }
+    # Auto installed as soon as all dependencies are
+    assert graph.closure(["base"]) == {"base", "web"}
+    with pytest.raises(ModuleNotFound):
+        graph.closure(["not_a_module"])
+
+
+def test_graph_dependents(graph):
+    assert graph.dependents["mail"] == {"sale", "sale_mail"}
+    assert graph.dependents_closure(["web"]) == {
+        "web",
+        "mail",
+        "sale",
+        "sale_mail",
+        "chained",
+    }
@@ -3,7 +3,8 @@ import pathlib
 import psycopg2
 from click.testing import CliRunner
 
-from dodoo import RUNMODE
+import dodoo
+from dodoo import RUNMODE, STAGE, Bootstrap
 from dodoo.cli import main
 
 
@@ -48,3 +49,53 @@ class TestCLI:
         dodoo._framework.dodoo_project_version = None
         dodoo._framework.dodoo_config = None
         dodoo._framework = None
+        dodoo._config = None
+        dodoo._bootstrap = None
+
+    def test_stages(self, confd, project_version_file, mocker):
+        schema = mocker.patch("dodoo.create_custom_schema_layout")
+        dodoo.main(
+            None,
+            confd,
+            False,
+            RUNMODE.Production,
+            0,
+            None,
+            project_version_file,
+            stages=[STAGE.Config],
+        )
+        assert list(dodoo._bootstrap.timings) == [STAGE.Config]
+        assert dodoo._framework is None
+        assert dodoo.config().Db.odoo_schema == "odoo"
+        assert not schema.called
+
+        dodoo._config = None
+        dodoo._bootstrap = None
+
+    def test_schema_stage(self, confd, project_version_file, mocker):
+        create = mocker.patch("dodoo.create_custom_schema_layout")
+        args = (None, confd, False, RUNMODE.Production, 0, None, project_version_file)
+        dodoo.main(*args, stages=[STAGE.Schema])
+        created = {c[0][0] for c in create.call_args_list}
+        Db = dodoo.config().Db
+        assert created == set(Db.per_dbname_dsn.values()) | {Db.default_dsn}
+
+        # Skipped, once created
+        create.reset_mock()
+        dodoo.main(*args, stages=[STAGE.Schema])
+        assert not create.called
+
+        dodoo._config = None
+        dodoo._bootstrap = None
+
+
+def test_bootstrap_requires(mocker):
+    bootstrap = Bootstrap(None, None, False, RUNMODE.Production, None)
+    for stage in STAGE:
+        mocker.patch.object(bootstrap, f"_run_{stage.name.lower()}")
+    bootstrap.run(STAGE.Patches)
+    assert list(bootstrap.timings) == [STAGE.Config, STAGE.Framework, STAGE.Patches]
+    bootstrap.run(STAGE.Schema)
+    assert bootstrap._run_config.call_count == 1
+    assert bootstrap._run_schema.call_count == 1
+    assert "patches" in str(bootstrap)
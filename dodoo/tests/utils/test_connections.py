@@ -0,0 +1,86 @@
+import pytest
+from psycopg2.extensions import make_dsn
+
+from dodoo.connections import (
+    POOL,
+    ConnectionPool,
+    OdooCursor,
+    SchemaLayoutMarkers,
+    ensure_schema_layout,
+)
+
+
+@pytest.fixture
+def dsn(pg_conn_main):
+    yield make_dsn(**pg_conn_main.info.dsn_parameters)
+
+
+def test_pool_reuses_connections(dsn):
+    pool = ConnectionPool()
+    conn = pool.getconn(dsn, "odoo")
+    pool.putconn(conn, dsn, "odoo")
+    assert pool.getconn(dsn, "odoo") is conn
+    assert pool.stats["hits"] == 1
+    assert pool.stats["misses"] == 1
+    # Keyed by schema
+    other = pool.getconn(dsn, "public")
+    assert other is not conn
+    assert pool.stats["misses"] == 2
+    pool.putconn(conn, dsn, "odoo")
+    pool.putconn(other, dsn, "public")
+    assert pool.stats["idle"] == 2
+    pool.discard(conn.info.dbname)
+    assert pool.stats["idle"] == 0
+    assert conn.closed
+
+
+def test_pool_autocommit_reset(dsn):
+    pool = ConnectionPool()
+    conn = pool.getconn(dsn, autocommit=True)
+    with conn.cursor() as cr:
+        cr.execute("SELECT pg_advisory_lock(42)")
+    pool.putconn(conn, dsn)
+    conn = pool.getconn(dsn)
+    with conn.cursor() as cr:
+        cr.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'")
+        assert cr.fetchone()[0] == 0
+    pool.putconn(conn, dsn)
+
+
+def test_schema_cursor_search_path(dsn):
+    hits = POOL.stats["hits"]
+    for _i in range(2):
+        with OdooCursor(dsn) as cr:
+            cr.execute("SHOW search_path")
+            assert cr.fetchone()[0] == "odoo"
+    assert POOL.stats["hits"] == hits + 1
+
+
+def test_schema_layout_markers(tmp_path):
+    file = tmp_path / "markers.json"
+    markers = SchemaLayoutMarkers(file)
+    markers.mark("host=a", ["odoo", "dodoo"])
+    markers.mark("host=b", ["odoo", "dodoo"])
+    markers.save()
+    assert "host=a" not in file.read_text()
+    mtime = file.stat().st_mtime_ns
+
+    markers = SchemaLayoutMarkers(file)
+    assert markers.created("host=a", ["odoo", "dodoo"])
+    assert not markers.created("host=a", ["odoo", "other"])
+    markers.save()  # Unchanged, not rewritten
+    assert file.stat().st_mtime_ns == mtime
+    markers.retain(["host=a"], ["odoo", "dodoo"])
+    markers.save()
+    assert not SchemaLayoutMarkers(file).created("host=b", ["odoo", "dodoo"])
+
+
+def test_ensure_schema_layout(pg_conn_main):
+    with pg_conn_main.cursor() as cr:
+        cr.execute("DROP SCHEMA IF EXISTS dodoo_recreated")
+    pg_conn_main.commit()
+    assert ensure_schema_layout(pg_conn_main, ["public", "dodoo_recreated"])
+    assert not ensure_schema_layout(pg_conn_main, ["public", "dodoo_recreated"])
+    with pg_conn_main.cursor() as cr:
+        cr.execute("DROP SCHEMA dodoo_recreated")
+    pg_conn_main.commit()
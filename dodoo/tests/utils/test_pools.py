@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from dodoo.pools import DatabasePool, PoolExhaustedError, PoolManager
+
+
+@pytest.fixture
+def info(pg_conn_main):
+    params = pg_conn_main.info.dsn_parameters
+    yield {k: v for k, v in params.items() if k in ("dbname", "user", "host", "port")}
+
+
+def test_pool_reuses_connections(info):
+    pool = DatabasePool(info["dbname"], 2)
+    cnx = pool.borrow(info)
+    pool.give_back(cnx)
+    assert pool.borrow(info) is cnx
+    assert pool.stats["used"] == 1
+    assert pool.stats["saturation"] == 0.5
+    pool.give_back(cnx, keep_in_pool=False)
+    assert cnx.closed
+    assert pool.stats["idle"] == 0
+
+
+def test_pool_waits_for_connections(info, mocker):
+    mocker.patch.object(DatabasePool, "WAIT_TIMEOUT", 0.1)
+    pool = DatabasePool(info["dbname"], 1)
+    cnx = pool.borrow(info)
+    with pytest.raises(PoolExhaustedError):
+        pool.borrow(info)
+    assert pool.stats["exhausted"] == 1
+    mocker.patch.object(DatabasePool, "WAIT_TIMEOUT", 5)
+    threading.Timer(0.1, pool.give_back, [cnx]).start()
+    assert pool.borrow(info) is cnx
+    assert pool.stats["waited"] == 1
+    assert pool.stats["max_wait_seconds"] >= 0.1
+    pool.close_all()
+
+
+def test_pool_idle_timeout(info, mocker):
+    mocker.patch.object(DatabasePool, "IDLE_TIMEOUT", 0)
+    pool = DatabasePool(info["dbname"], 2)
+    cnx = pool.borrow(info)
+    pool.give_back(cnx)
+    pool.reap()
+    assert cnx.closed
+    assert pool.stats["idle"] == 0
+
+
+def test_pool_drain(info):
+    pool = DatabasePool(info["dbname"], 2)
+    idle = pool.borrow(info)
+    used = pool.borrow(info)
+    pool.give_back(idle)
+    pool.drain()
+    assert idle.closed
+    assert not used.closed
+    pool.give_back(used)
+    assert used.closed
+    assert pool.stats["idle"] == 0
+
+
+def test_pool_prepare(info, mocker):
+    prepare = mocker.Mock()
+    pool = DatabasePool(info["dbname"], 2, prepare)
+    cnx = pool.borrow(info)
+    other = pool.borrow(info)
+    prepare.assert_called_once_with(cnx)
+    pool.give_back(other)
+    pool.drain()
+    pool.give_back(cnx)
+    cnx = pool.borrow(info)
+    assert prepare.call_count == 2
+    pool.give_back(cnx)
+    prepare.side_effect = RuntimeError
+    pool.drain()
+    with pytest.raises(RuntimeError):
+        pool.borrow(info)
+    assert pool.stats["used"] == 0
+
+
+def test_manager_per_database(info):
+    manager = PoolManager()
+    pool = manager.get("db1", "2")
+    assert pool.maxconn == 2
+    assert manager.get("db1", 2) is pool
+    assert manager.get("db2", 3) is not pool
+    # Resized in place, as odoo's registries hold on to it
+    assert manager.get("db1", 4) is pool
+    assert pool.maxconn == 4
+    cnx = pool.borrow(info)
+    pool.give_back(cnx)
+    manager.close("db1")
+    assert cnx.closed
+    assert set(manager.stats) == {"db1", "db2"}
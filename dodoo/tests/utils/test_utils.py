@@ -34,6 +34,23 @@ class TestDbUtils:
         assert "-p" in args
         assert "--no-password" in args
 
+    def test_stream_copy_db_snapshot_server(self, mocker):
+        dsns = {
+            "postgres": "host=db port=5432 user=u",
+            "src": "host=pg port=6432 user=u",
+        }
+        mocker.patch.object(dbutils, "_dsn_resolver", dsns.get)
+        mocker.patch.dict("sys.modules", sh=mocker.Mock())
+        mocker.patch.object(dbutils, "create_database")
+        mocker.patch.object(dbutils, "drop_database")
+        connect = mocker.patch.object(dbutils.psycopg2, "connect")
+        connect.side_effect = RuntimeError
+        with pytest.raises(RuntimeError):
+            dbutils.stream_copy_db("src", "dest")
+        params = dbutils.parse_dsn(connect.call_args[0][0])
+        assert params == {"host": "db", "port": "5432", "user": "u", "dbname": "src"}
+        dbutils.drop_database.assert_called_once_with("dest")
+
     def test_db_exists_sql(self, db):
         assert dbutils.db_exists(db)
         assert not dbutils.db_exists("no-" + db)
@@ -61,6 +78,27 @@ class TestDbUtils:
         dbutils.restore_database(restore, file)
         assert dbutils.db_exists(restore)
 
+    def test_restore_database_stream(self, main_loaded, db, tmp_path):
+        assert dbutils.terminate_connections(db) == 1
+        restore = db + "restored"
+        file = tmp_path / "tempfile"
+        dbutils.backup_database(db, file)
+        with file.open("rb") as stream:
+            dbutils.restore_database_stream(restore, stream)
+        assert dbutils.db_exists(restore)
+        dbutils.rename_database(restore, restore + "renamed")
+        assert not dbutils.db_exists(restore)
+        assert dbutils.db_exists(restore + "renamed")
+
+    def test_backup_restore_database_directory(self, main_loaded, db, tmp_path):
+        assert dbutils.terminate_connections(db) == 1
+        restore = db + "restored"
+        directory = tmp_path / "db.dump"
+        dbutils.backup_database(db, directory, directory=True, jobs=2)
+        assert directory.is_dir()
+        dbutils.restore_database(restore, directory, jobs=2)
+        assert dbutils.db_exists(restore)
+
 
 class TestOdooUtils:
     def test_drop_filestore(self, fs):
@@ -71,7 +109,7 @@ class TestOdooUtils:
     def test_copy_filestore(self, fs):
         db = fs.name
         new_db = fs.name + "new"
-        odooutils.copy_filestore(db, new_db)
+        odooutils.copy_filestore(db, new_db, max_workers=2)
         assert (fs.parent / new_db).exists()
 
     def test_backup_restore_filestore(self, fs, tmp_path):
@@ -83,6 +121,64 @@ class TestOdooUtils:
         odooutils.restore_filestore(db, bkp)
         assert fs.exists()
 
+    def test_clone_tree(self, tmp_path):
+        src = tmp_path / "src"
+        (src / "ab").mkdir(parents=True)
+        (src / "ab" / "ab1234").write_text("blob")
+        (src / "ab" / "abcdef").write_text("other blob")
+        (src / "checklist").mkdir()
+        linked = tmp_path / "linked"
+        stats = odooutils.clone_tree(src, linked, ("hardlink", "copy"))
+        assert (stats.method, stats.files, stats.bytes) == ("hardlink", 2, 14)
+        assert (linked / "ab" / "abcdef").stat().st_nlink == 2
+        assert (linked / "checklist").is_dir()
+        copied = tmp_path / "copied"
+        odooutils.clone_tree(src, copied, odooutils.BACKUP_CLONE_METHODS)
+        assert (copied / "ab" / "abcdef").stat().st_nlink == 1
+        assert (copied / "ab" / "abcdef").read_text() == "other blob"
+        assert "files/s" in str(odooutils.clone_tree(src, tmp_path / "fast", ["copy"]))
+        with pytest.raises(odooutils.TargetFilestoreExistsError):
+            odooutils.clone_tree(src, copied)
+
+    def test_backup_restore_filestore_blobs(self, fs, tmp_path, mocker):
+        db = fs.name
+        blobs = tmp_path / "blobs"
+        (fs / "ab").mkdir()
+        (fs / "ab" / "abcdef").write_text("blob")
+        (fs / "checklist").mkdir()
+        assert odooutils.backup_filestore_blobs(db, blobs) == ["ab/abcdef"]
+        assert (blobs / "ab" / "abcdef").exists()
+        # Stored blobs are not copied again
+        (fs / "ab" / "ab1234").write_text("new blob")
+        spy = mocker.spy(odooutils, "_clone_file")
+        fnames = odooutils.backup_filestore_blobs(db, blobs)
+        assert fnames == ["ab/ab1234", "ab/abcdef"]
+        assert spy.call_count == 1
+        odooutils.drop_filestore(db)
+        odooutils.restore_filestore_blobs(db, blobs, fnames)
+        assert (fs / "ab" / "abcdef").read_text() == "blob"
+        odooutils.drop_filestore(db)
+
+    def test_store_blob_concurrently(self, tmp_path, mocker):
+        src = tmp_path / "abcdef"
+        src.write_text("blob")
+        dest = tmp_path / "blobs" / "ab" / "abcdef"
+        clone_file = odooutils._clone_file
+        partials = []
+
+        def racing_clone_file(src, partial, methods):
+            partials.append(partial)
+            if len(partials) == 1:
+                # Another backup stores the same blob meanwhile
+                odooutils._store_blob(src, dest)
+            return clone_file(src, partial, methods)
+
+        mocker.patch.object(odooutils, "_clone_file", racing_clone_file)
+        odooutils._store_blob(src, dest)
+        assert partials[0] != partials[1]
+        assert dest.read_text() == "blob"
+        assert [p.name for p in dest.parent.iterdir()] == ["abcdef"]
+
     def test_expand_dependencies(self, main_loaded):
         res = odooutils.expand_dependencies(
             ["auth_signup", "base_import"], include_auto_install=False